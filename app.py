@@ -45,7 +45,7 @@ h1, h2, h3, h4, h5, h6 {
 """, unsafe_allow_html=True)
 
 # Import our modules
-from config import APP_NAME, APP_VERSION, BudgetType, FileStatus
+from config import APP_NAME, APP_VERSION, SHOW_BALLOONS, BudgetType, FileStatus
 from database import init_db, check_database_connection, seed_demo_users, User, BudgetFile, BudgetItem
 from modules.excel_handler import (
     process_uploaded_file,
@@ -254,7 +254,8 @@ def show_auth_page():
                     if user:
                         login_with_jwt(user)
                         st.success(f"✅ Тавтай морил, {user.full_name or user.username}!")
-                        st.balloons()
+                        if SHOW_BALLOONS:
+                            st.balloons()
                         st.rerun()
                     else:
                         st.error("❌ Email эсвэл нууц үг буруу байна")
@@ -323,7 +324,8 @@ def show_auth_page():
                     if success:
                         st.success(f"✅ {message}")
                         st.info("👆 'Нэвтрэх' tab дээр дарж нэвтэрнэ үү")
-                        st.balloons()
+                        if SHOW_BALLOONS:
+                            st.balloons()
                     else:
                         st.error(f"❌ {message}")
         
@@ -53,6 +53,10 @@ SESSION_TIMEOUT = 30
 # Maximum file upload size (in MB)
 MAX_UPLOAD_SIZE_MB = 50
 
+# Celebration animation after login/upload (client-side canvas work that
+# slows reruns on low-power clients) - off unless SHOW_BALLOONS=true
+SHOW_BALLOONS = os.getenv("SHOW_BALLOONS", "false").lower() == "true"
+
 
 # =============================================================================
 # ENUMS - Status and Role Definitions
@@ -139,3 +143,12 @@ SIGNED_FILES_DIR = "assets/signed_files"
 
 # Allowed file types for signed document uploads
 ALLOWED_SIGNED_FILE_TYPES = [".pdf", ".jpg", ".jpeg", ".png"]
+
+# Serve preview PDFs as static files instead of embedding them as base64.
+# Requires `server.enableStaticServing = true` in .streamlit/config.toml.
+# NOTE: Streamlit static files are public (no login check) - enable only
+# on deployments where that is acceptable.
+STATIC_PREVIEWS = os.getenv("STATIC_PREVIEWS", "false").lower() == "true"
+
+# Streamlit serves ./static/<path> at app/static/<path>
+STATIC_PREVIEW_DIR = "static/previews"
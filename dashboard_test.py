@@ -12,7 +12,9 @@ Author: CPP Development Team
 
 import streamlit as st
 import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, JsCode
+from st_aggrid import AgGrid, GridUpdateMode, DataReturnMode, JsCode
+
+from modules.streamlit_compat import fragment
 
 # =============================================================================
 # PAGE CONFIGURATION
@@ -77,7 +79,116 @@ def get_demo_data() -> pd.DataFrame:
          'specialist': 'admin', 'description': 'Magazine full page ad'},
     ]
     
-    return pd.DataFrame(data)
+    df = pd.DataFrame(data)
+    
+    # Low-cardinality columns compared/filtered on every rerun
+    for col in ('specialist', 'channel'):
+        df[col] = df[col].astype('category')
+    
+    return df
+
+
+# =============================================================================
+# AGGRID JS FUNCTIONS
+# =============================================================================
+# Built once per process. The current user is passed to the grid as
+# context.currentUser, so the JS source is the same for every user/rerun.
+
+# Cell Editable Function - true only if row's specialist matches current user
+IS_EDITABLE_JS = JsCode("""
+function(params) {
+    return params.data.specialist === params.context.currentUser;
+}
+""")
+
+# Row Styling - green background for user's own rows
+ROW_STYLE_JS = JsCode("""
+function(params) {
+    if (params.data.specialist === params.context.currentUser) {
+        return {
+            'backgroundColor': '#d4edda',
+            'borderLeft': '4px solid #28a745'
+        };
+    }
+    return {
+        'backgroundColor': '#f8f9fa'
+    };
+}
+""")
+
+# Cell Styling - gray out non-editable cells
+CELL_STYLE_JS = JsCode("""
+function(params) {
+    if (params.data.specialist !== params.context.currentUser) {
+        return {'color': '#6c757d'};
+    }
+    return {'color': '#212529'};
+}
+""")
+
+# Amount Formatter
+AMOUNT_FORMATTER_JS = JsCode("""
+function(params) {
+    if (params.value != null) {
+        return '₮' + Number(params.value).toLocaleString();
+    }
+    return '';
+}
+""")
+
+
+# =============================================================================
+# AGGRID GRID OPTIONS
+# =============================================================================
+# Column definitions written out once instead of GridOptionsBuilder calls
+# on every rerun; only the context (current user) differs per render.
+
+# Columns the owner may edit (IS_EDITABLE_JS below); verify_changes checks these
+EDITABLE_FIELDS = (
+    'campaign_name', 'budget_code', 'vendor', 'amount_planned',
+    'start_date', 'end_date', 'description',
+)
+
+GRID_COLUMN_DEFS = [
+    # ID - hidden
+    {'field': 'id', 'headerName': 'id', 'hide': True,
+     'type': ['numericColumn', 'numberColumnFilter']},
+    
+    # Editable columns (only for owner)
+    {'field': 'campaign_name', 'headerName': 'Campaign', 'editable': IS_EDITABLE_JS, 'width': 180},
+    {'field': 'budget_code', 'headerName': 'Code', 'editable': IS_EDITABLE_JS, 'width': 100},
+    {'field': 'vendor', 'headerName': 'Vendor', 'editable': IS_EDITABLE_JS, 'width': 130},
+    {'field': 'channel', 'headerName': 'Channel', 'editable': False, 'width': 90},
+    {'field': 'amount_planned', 'headerName': '💰 Amount', 'editable': IS_EDITABLE_JS,
+     'type': ['numericColumn'], 'valueFormatter': AMOUNT_FORMATTER_JS, 'width': 140},
+    {'field': 'start_date', 'headerName': 'Start', 'editable': IS_EDITABLE_JS, 'width': 110},
+    {'field': 'end_date', 'headerName': 'End', 'editable': IS_EDITABLE_JS, 'width': 110},
+    
+    # Specialist - pinned, read-only, bold
+    {'field': 'specialist', 'headerName': '👤 Specialist', 'pinned': 'left', 'width': 120,
+     'editable': False, 'cellStyle': {'fontWeight': 'bold'}},
+    
+    {'field': 'description', 'headerName': 'Description', 'editable': IS_EDITABLE_JS, 'width': 200},
+]
+
+GRID_OPTIONS = {
+    'columnDefs': GRID_COLUMN_DEFS,
+    # Default settings
+    'defaultColDef': {
+        'resizable': True,
+        'filterable': True,
+        'sortable': True,
+        'editable': False,
+        'cellStyle': CELL_STYLE_JS,
+    },
+    # Row styling
+    'getRowStyle': ROW_STYLE_JS,
+    'domLayout': 'normal',
+    'autoSizeStrategy': {'type': 'fitGridWidth'},
+    # Pagination
+    'pagination': True,
+    'paginationAutoPageSize': True,
+}
 
 
 # =============================================================================
@@ -94,120 +205,9 @@ def create_secure_grid(df: pd.DataFrame, current_user: str):
     - Visual highlighting for editable rows
     """
     
-    # ===================
-    # JsCode: Cell Editable Function
-    # ===================
-    # Returns true only if row's specialist matches current user
-    
-    is_editable = JsCode(f"""
-    function(params) {{
-        return params.data.specialist === '{current_user}';
-    }}
-    """)
-    
-    # ===================
-    # JsCode: Row Styling
-    # ===================
-    # Green background for user's own rows
-    
-    row_style = JsCode(f"""
-    function(params) {{
-        if (params.data.specialist === '{current_user}') {{
-            return {{
-                'backgroundColor': '#d4edda',
-                'borderLeft': '4px solid #28a745'
-            }};
-        }}
-        return {{
-            'backgroundColor': '#f8f9fa'
-        }};
-    }}
-    """)
-    
-    # ===================
-    # JsCode: Cell Styling
-    # ===================
-    # Gray out non-editable cells
-    
-    cell_style = JsCode(f"""
-    function(params) {{
-        if (params.data.specialist !== '{current_user}') {{
-            return {{'color': '#6c757d'}};
-        }}
-        return {{'color': '#212529'}};
-    }}
-    """)
-    
-    # ===================
-    # Amount Formatter
-    # ===================
-    
-    amount_formatter = JsCode("""
-    function(params) {
-        if (params.value != null) {
-            return '₮' + Number(params.value).toLocaleString();
-        }
-        return '';
-    }
-    """)
-    
-    # ===================
-    # Build Grid Options
-    # ===================
-    
-    gb = GridOptionsBuilder.from_dataframe(df)
-    
-    # Default settings
-    gb.configure_default_column(
-        resizable=True,
-        filterable=True,
-        sortable=True,
-        editable=False,
-        cellStyle=cell_style
-    )
-    
-    # ID - hidden
-    gb.configure_column('id', hide=True)
-    
-    # Specialist - pinned, read-only, bold
-    gb.configure_column(
-        'specialist',
-        headerName='👤 Specialist',
-        pinned='left',
-        width=120,
-        editable=False,
-        cellStyle={'fontWeight': 'bold'}
-    )
-    
-    # Editable columns (only for owner)
-    gb.configure_column('campaign_name', headerName='Campaign', editable=is_editable, width=180)
-    gb.configure_column('budget_code', headerName='Code', editable=is_editable, width=100)
-    gb.configure_column('vendor', headerName='Vendor', editable=is_editable, width=130)
-    gb.configure_column('channel', headerName='Channel', editable=False, width=90)
-    
-    gb.configure_column(
-        'amount_planned',
-        headerName='💰 Amount',
-        editable=is_editable,
-        type=['numericColumn'],
-        valueFormatter=amount_formatter,
-        width=140
-    )
-    
-    gb.configure_column('start_date', headerName='Start', editable=is_editable, width=110)
-    gb.configure_column('end_date', headerName='End', editable=is_editable, width=110)
-    gb.configure_column('description', headerName='Description', editable=is_editable, width=200)
-    
-    # Grid options with row styling
-    gb.configure_grid_options(
-        getRowStyle=row_style,
-        domLayout='normal'
-    )
-    
-    # Pagination
-    gb.configure_pagination(enabled=True, paginationPageSize=10)
-    
-    grid_options = gb.build()
+    # Shared column setup plus this user's context (fresh top-level dict,
+    # AgGrid may set keys on it)
+    grid_options = dict(GRID_OPTIONS, context={'currentUser': current_user})
     
     # Render grid
     return AgGrid(
@@ -226,6 +226,7 @@ def create_secure_grid(df: pd.DataFrame, current_user: str):
 # BACKEND SECURITY CHECK
 # =============================================================================
 
+
 def verify_changes(original_df: pd.DataFrame, updated_df: pd.DataFrame, current_user: str):
     """
     Backend verification: Only allow saving changes to user's own rows.
@@ -236,34 +237,110 @@ def verify_changes(original_df: pd.DataFrame, updated_df: pd.DataFrame, current_
         'messages': []
     }
     
-    # Compare each row
-    for idx, row in updated_df.iterrows():
-        row_id = row['id']
-        specialist = row['specialist']
+    if updated_df.empty:
+        return results
+    
+    # Fast path: Save clicked without any edits (same rows, same values)
+    if (
+        len(updated_df) == len(original_df)
+        and original_df.columns.difference(updated_df.columns).empty
+        and updated_df[original_df.columns].reset_index(drop=True).equals(original_df.reset_index(drop=True))
+    ):
+        return results
+    
+    # Rows present in both frames (first original row per id), compared as
+    # text column by column; missing on both sides counts as unchanged
+    original_by_id = original_df.drop_duplicates('id').set_index('id')
+    updated_rows = updated_df[updated_df['id'].isin(original_by_id.index)]
+    
+    updated_text = updated_rows.reindex(columns=list(EDITABLE_FIELDS), fill_value='').astype(str)
+    original_text = (
+        original_by_id.reindex(columns=list(EDITABLE_FIELDS), fill_value='')
+        .loc[updated_rows['id']]
+        .astype(str)
+    )
+    updated_values = updated_text.to_numpy()
+    original_values = original_text.to_numpy()
+    # x != x is only true for NaN, so missing-vs-missing needs no isna() pass
+    changed = (
+        (updated_values != original_values)
+        & ~((updated_values != updated_values) & (original_values != original_values))
+    ).any(axis=1)
+    
+    # Split the changed rows by owner in one comparison
+    changed_rows = updated_rows[changed]
+    is_own = changed_rows['specialist'].to_numpy() == current_user
+    results['authorized'] = changed_rows.loc[is_own, 'id'].tolist()
+    others = changed_rows.loc[~is_own]
+    results['unauthorized'] = [
+        {'id': row_id, 'owner': owner}
+        for row_id, owner in zip(others['id'].tolist(), others['specialist'].tolist())
+    ]
+    
+    return results
+
+
+# =============================================================================
+# GRID SECTION
+# =============================================================================
+
+@fragment
+def show_grid_section(df: pd.DataFrame, current_user: str):
+    """Grid plus save/verification; its widgets rerun only this section."""
+    # Render secure grid
+    st.subheader("📋 Budget Data")
+    
+    grid_response = create_secure_grid(df, current_user)
+    
+    # No grid event yet means nothing was edited: compare against the input
+    # frame instead of rebuilding one from the grid payload
+    if grid_response.event_data is None:
+        updated_df = df
+    else:
+        updated_df = grid_response['data']
+        if not isinstance(updated_df, pd.DataFrame):
+            updated_df = pd.DataFrame(updated_df)
+    
+    # ===================
+    # Save Button with Security Check
+    # ===================
+    
+    st.divider()
+    
+    col1, col2 = st.columns([1, 3])
+    
+    with col1:
+        save_clicked = st.button("💾 Save Changes", type="primary")
+    
+    if save_clicked:
+        st.subheader("🔒 Security Verification Results")
         
-        # Find original
-        orig = original_df[original_df['id'] == row_id]
-        if orig.empty:
-            continue
-        orig = orig.iloc[0]
+        # Run backend verification
+        results = verify_changes(st.session_state.original_data, updated_df, current_user)
         
-        # Check if changed
-        changed = False
-        for col in ['campaign_name', 'budget_code', 'vendor', 'amount_planned', 'description']:
-            if str(row.get(col, '')) != str(orig.get(col, '')):
-                changed = True
-                break
+        if results['authorized']:
+            st.success(f"✅ {len(results['authorized'])} row(s) authorized for update: IDs {results['authorized']}")
         
-        if changed:
-            if specialist == current_user:
-                results['authorized'].append(row_id)
-            else:
-                results['unauthorized'].append({
-                    'id': row_id,
-                    'owner': specialist
-                })
-    
-    return results
+        if results['unauthorized']:
+            st.error("⛔ UNAUTHORIZED EDITS BLOCKED!")
+            for item in results['unauthorized']:
+                st.error(f"Row ID {item['id']} belongs to **{item['owner']}** - You cannot edit this!")
+        
+        if not results['authorized'] and not results['unauthorized']:
+            st.info("No changes detected")
+        
+        # Show code example
+        with st.expander("🔍 View Security Check Code"):
+            st.code("""
+# Backend Security Check (Python)
+for row in updated_rows:
+    if row['specialist'] != current_username:
+        # BLOCK THE UPDATE!
+        errors.append(f"Unauthorized: Row {row['id']} belongs to {row['specialist']}")
+    else:
+        # Allow update
+        session.update(row)
+            """, language="python")
 
 
 # =============================================================================
@@ -322,80 +399,41 @@ def main():
     
     st.info(f"👤 You are logged in as **{current_user}**. Only green rows (your data) can be edited.")
     
-    # Load demo data
-    df = get_demo_data()
-    original_df = df.copy()
+    # Load demo data once per session; get_demo_data's cache would still
+    # hand back a fresh (unpickled) copy on every rerun
+    if 'demo_data' not in st.session_state:
+        st.session_state.demo_data = get_demo_data()
+    df = st.session_state.demo_data
     
-    # Store in session for comparison
+    # Store in session for comparison (only what verify_changes reads)
     if 'original_data' not in st.session_state:
-        st.session_state.original_data = df.copy()
+        st.session_state.original_data = df[['id', 'specialist', *EDITABLE_FIELDS]].copy()
+    
+    # Summary metrics, computed together up front (one pass per column)
+    stats = {
+        'total': df['amount_planned'].to_numpy().sum(),
+        'rows': len(df),
+        'mine': int(df['specialist'].eq(current_user).to_numpy().sum()),
+    }
     
-    # Summary metrics
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total = df['amount_planned'].sum()
-        st.metric("💰 Total Budget", f"₮{total:,.0f}")
+        st.metric("💰 Total Budget", f"₮{stats['total']:,.0f}")
     
     with col2:
-        st.metric("📋 Total Rows", len(df))
+        st.metric("📋 Total Rows", stats['rows'])
     
     with col3:
-        my_rows = len(df[df['specialist'] == current_user])
-        st.metric("✏️ My Rows", my_rows)
+        st.metric("✏️ My Rows", stats['mine'])
     
     with col4:
-        others_rows = len(df[df['specialist'] != current_user])
-        st.metric("🔒 Others' Rows", others_rows)
-    
-    st.divider()
-    
-    # Render secure grid
-    st.subheader("📋 Budget Data")
-    
-    grid_response = create_secure_grid(df, current_user)
-    updated_df = pd.DataFrame(grid_response['data'])
-    
-    # ===================
-    # Save Button with Security Check
-    # ===================
+        st.metric("🔒 Others' Rows", stats['rows'] - stats['mine'])
     
     st.divider()
     
-    col1, col2 = st.columns([1, 3])
-    
-    with col1:
-        save_clicked = st.button("💾 Save Changes", type="primary")
-    
-    if save_clicked:
-        st.subheader("🔒 Security Verification Results")
-        
-        # Run backend verification
-        results = verify_changes(st.session_state.original_data, updated_df, current_user)
-        
-        if results['authorized']:
-            st.success(f"✅ {len(results['authorized'])} row(s) authorized for update: IDs {results['authorized']}")
-        
-        if results['unauthorized']:
-            st.error("⛔ UNAUTHORIZED EDITS BLOCKED!")
-            for item in results['unauthorized']:
-                st.error(f"Row ID {item['id']} belongs to **{item['owner']}** - You cannot edit this!")
-        
-        if not results['authorized'] and not results['unauthorized']:
-            st.info("No changes detected")
-        
-        # Show code example
-        with st.expander("🔍 View Security Check Code"):
-            st.code("""
-# Backend Security Check (Python)
-for row in updated_rows:
-    if row['specialist'] != current_username:
-        # BLOCK THE UPDATE!
-        errors.append(f"Unauthorized: Row {row['id']} belongs to {row['specialist']}")
-    else:
-        # Allow update
-        session.update(row)
-            """, language="python")
+    # Render secure grid (reruns on grid edits stay inside the section)
+    show_grid_section(df, current_user)
 
 
 # =============================================================================
@@ -23,8 +23,8 @@ from contextlib import contextmanager
 from typing import Generator, Optional
 
 from sqlmodel import SQLModel, Session, create_engine, text
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine, make_url
 
 # Import configuration
 from config import DATABASE_URL, DATABASE_TYPE
@@ -58,15 +58,26 @@ def get_engine_args() -> dict:
         }
     else:
         # PostgreSQL configuration - Optimized for 15-20 concurrent users
-        return {
+        engine_args = {
             # Connection pool settings for production
             "pool_size": 15,             # Base connections (matches expected users)
             "max_overflow": 20,          # Extra connections for peak load (total max: 35)
             "pool_timeout": 30,          # Seconds to wait for connection
             "pool_recycle": 1800,        # Recycle connections after 30 minutes
             "pool_pre_ping": True,       # Test connections before use
+            # Rows per multi-VALUES statement for bulk inserts (default 1000)
+            "insertmanyvalues_page_size": 10000,
             "echo": False,
         }
+        
+        # psycopg2 (also the default for plain postgresql:// URLs): batch
+        # executemany UPDATE/DELETE pages too; INSERTs already go through
+        # multi-VALUES pages above. psycopg 3 uses insertmanyvalues by default.
+        if make_url(DATABASE_URL).get_driver_name() == "psycopg2":
+            engine_args["executemany_mode"] = "values_plus_batch"
+            engine_args["executemany_batch_page_size"] = 500
+        
+        return engine_args
 
 
 # Create the database engine (singleton pattern)
@@ -171,6 +182,20 @@ def init_db() -> None:
     
     # Create all tables
     SQLModel.metadata.create_all(engine)
+    
+    # create_all() skips existing tables, so add indexes introduced later
+    for index in BudgetFile.__table__.indexes:
+        try:
+            index.create(engine, checkfirst=True)
+        except Exception as e:
+            # e.g. the unique file_hash index on a database that already
+            # holds duplicate uploads - the app-level check still applies
+            logger.warning(f"Could not create index {index.name}: {str(e)}")
+    
+    # The plain file_hash index is superseded by uq_budget_files_file_hash
+    if inspect(engine).has_index(BudgetFile.__tablename__, "uq_budget_files_file_hash"):
+        with engine.begin() as conn:
+            conn.execute(text("DROP INDEX IF EXISTS ix_budget_files_file_hash"))
     logger.info("Database tables created successfully")
 
 
@@ -331,6 +331,8 @@ class BudgetFile(SQLModel, table=True):
         # Composite index for common queries
         Index('ix_budget_files_status_uploader', 'status', 'uploader_id'),
         Index('ix_budget_files_uploaded_at', 'uploaded_at'),
+        # One record per file content; enforces dedup between concurrent uploads
+        Index('uq_budget_files_file_hash', 'file_hash', unique=True),
         {'extend_existing': True}
     )
     
@@ -1,36 +1,36 @@
 """
 Modules for Central Planning Platform
-"""
 
-from .excel_handler import (
-    process_uploaded_file,
-    validate_dataframe,
-    get_file_preview,
-    detect_channel_from_filename,
-    dataframe_to_budget_items
-)
+Package-level names are imported on first use, so importing a single
+submodule (e.g. modules.services) does not load the Excel handler or
+the seeder.
+"""
 
-from .seeder import (
-    seed_all_reference_data,
-    seed_budget_codes,
-    seed_channel_categories,
-    seed_channel_activities,
-    get_reference_data_stats,
-    clear_reference_data
-)
+import importlib
 
-__all__ = [
+_EXPORTS = {
     # Excel Handler
-    'process_uploaded_file',
-    'validate_dataframe',
-    'get_file_preview',
-    'detect_channel_from_filename',
-    'dataframe_to_budget_items',
+    'process_uploaded_file': '.excel_handler',
+    'validate_dataframe': '.excel_handler',
+    'get_file_preview': '.excel_handler',
+    'detect_channel_from_filename': '.excel_handler',
+    'extract_metadata_from_filename': '.excel_handler',
+    'dataframe_to_budget_items': '.excel_handler',
     # Seeder
-    'seed_all_reference_data',
-    'seed_budget_codes',
-    'seed_channel_categories',
-    'seed_channel_activities',
-    'get_reference_data_stats',
-    'clear_reference_data',
-]
+    'seed_all_reference_data': '.seeder',
+    'seed_budget_codes': '.seeder',
+    'seed_channel_categories': '.seeder',
+    'seed_channel_activities': '.seeder',
+    'get_reference_data_stats': '.seeder',
+    'clear_reference_data': '.seeder',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
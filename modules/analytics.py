@@ -14,8 +14,8 @@ Functions:
 """
 
 from typing import Dict, List, Optional, Any
-from decimal import Decimal
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
 from sqlmodel import Session, select, func
@@ -23,52 +23,92 @@ from database.models import BudgetFile, BudgetItem
 from config import FileStatus
 
 
+# Only approved files should appear in Dashboard
+APPROVED_STATUSES = [
+    FileStatus.APPROVED_FOR_PRINT,
+    FileStatus.SIGNING,
+    FileStatus.FINALIZED
+    # PENDING_APPROVAL and REJECTED are excluded from Dashboard
+]
+
+# First letter of budget_code -> company
+COMPANY_MAP = {
+    'A': 'Юнител',
+    'B': 'Юнивишн',
+    'G': 'Green Future',
+    'J': 'IVLBS',
+    'T': 'MPSC'
+}
+
+
 def get_approved_files(session: Session) -> List[BudgetFile]:
     """
     Get all approved budget files.
     Includes files with status: APPROVED_FOR_PRINT, SIGNING, FINALIZED
     Only approved files should appear in Dashboard.
     """
-    approved_statuses = [
-        FileStatus.APPROVED_FOR_PRINT,
-        FileStatus.SIGNING,
-        FileStatus.FINALIZED
-        # PENDING_APPROVAL and REJECTED are excluded from Dashboard
-    ]
-    
-    query = select(BudgetFile).where(BudgetFile.status.in_(approved_statuses))
+    query = select(BudgetFile).where(BudgetFile.status.in_(APPROVED_STATUSES))
     return list(session.exec(query).all())
 
 
+def get_approved_files_df(session: Session) -> pd.DataFrame:
+    """
+    Get the columns the analytics need for all approved files as a DataFrame.
+    
+    Rows are read as plain tuples (no ORM objects) and handed to pandas in
+    one from_records call. Amounts become float64 (missing values as 0) and
+    uploaded_at datetime64, so no column holds boxed Decimal/datetime objects.
+    
+    Returns:
+        DataFrame with columns: filename, budget_code, planned_amount,
+        total_amount, uploaded_at
+    """
+    query = select(
+        BudgetFile.filename,
+        BudgetFile.budget_code,
+        BudgetFile.planned_amount,
+        BudgetFile.total_amount,
+        BudgetFile.uploaded_at
+    ).where(BudgetFile.status.in_(APPROVED_STATUSES))
+    
+    df = pd.DataFrame.from_records(
+        session.exec(query).all(),
+        columns=['filename', 'budget_code', 'planned_amount', 'total_amount', 'uploaded_at']
+    )
+    for col in ('planned_amount', 'total_amount'):
+        df[col] = pd.to_numeric(df[col]).fillna(0.0).astype(float)
+    df['uploaded_at'] = pd.to_datetime(df['uploaded_at'])
+    return df
+
+
 def get_budget_summary(session: Session) -> Dict[str, Any]:
     """
     Get overall budget summary statistics.
     
     Returns:
         Dict with:
-        - total_planned: Total planned budget (НИЙТ ТӨСӨВ)
-        - total_actual: Total actual budget (НИЙТ БОДИТ ТӨСӨВ)
+        - total_planned: Total planned budget (НИЙТ ТӨСӨВ), float
+        - total_actual: Total actual budget (НИЙТ БОДИТ ТӨСӨВ), float
         - file_count: Number of approved files
         - avg_budget: Average budget per file
     """
-    files = get_approved_files(session)
+    df = get_approved_files_df(session)
     
-    if not files:
+    if df.empty:
         return {
-            'total_planned': Decimal(0),
-            'total_actual': Decimal(0),
+            'total_planned': 0.0,
+            'total_actual': 0.0,
             'file_count': 0,
-            'avg_budget': Decimal(0)
+            'avg_budget': 0.0
         }
     
-    total_planned = sum(f.planned_amount or Decimal(0) for f in files)
-    total_actual = sum(f.total_amount or Decimal(0) for f in files)
+    total_actual = float(df['total_amount'].sum())
     
     return {
-        'total_planned': total_planned,
+        'total_planned': float(df['planned_amount'].sum()),
         'total_actual': total_actual,
-        'file_count': len(files),
-        'avg_budget': total_actual / len(files) if files else Decimal(0)
+        'file_count': len(df),
+        'avg_budget': total_actual / len(df)
     }
 
 
@@ -80,48 +120,22 @@ def get_budget_by_company(session: Session) -> pd.DataFrame:
     Returns:
         DataFrame with columns: Company, PlannedAmount, ActualAmount, FileCount
     """
-    files = get_approved_files(session)
-    
-    company_map = {
-        'A': 'Юнител',
-        'B': 'Юнивишн',
-        'G': 'Green Future',
-        'J': 'IVLBS',
-        'T': 'MPSC'
-    }
+    df = get_approved_files_df(session)
+    df = df[df['budget_code'].fillna('') != '']
     
-    company_data = {}
-    
-    for f in files:
-        if f.budget_code:
-            company_code = f.budget_code[0].upper()
-            company_name = company_map.get(company_code, f'Other ({company_code})')
-            
-            if company_name not in company_data:
-                company_data[company_name] = {
-                    'PlannedAmount': Decimal(0),
-                    'ActualAmount': Decimal(0),
-                    'FileCount': 0
-                }
-            
-            company_data[company_name]['PlannedAmount'] += f.planned_amount or Decimal(0)
-            company_data[company_name]['ActualAmount'] += f.total_amount or Decimal(0)
-            company_data[company_name]['FileCount'] += 1
-    
-    if not company_data:
+    if df.empty:
         return pd.DataFrame(columns=['Company', 'PlannedAmount', 'ActualAmount', 'FileCount'])
     
-    df = pd.DataFrame([
-        {
-            'Company': company,
-            'PlannedAmount': float(data['PlannedAmount']),
-            'ActualAmount': float(data['ActualAmount']),
-            'FileCount': data['FileCount']
-        }
-        for company, data in company_data.items()
-    ])
+    company_code = df['budget_code'].str[0].str.upper()
+    company = company_code.map(COMPANY_MAP).fillna('Other (' + company_code + ')')
+    
+    result = df.groupby(company.rename('Company'), sort=False).agg(
+        PlannedAmount=('planned_amount', 'sum'),
+        ActualAmount=('total_amount', 'sum'),
+        FileCount=('planned_amount', 'size')
+    ).reset_index()
     
-    return df.sort_values('ActualAmount', ascending=False)
+    return result.sort_values('ActualAmount', ascending=False)
 
 
 def get_budget_by_month(session: Session) -> pd.DataFrame:
@@ -131,41 +145,33 @@ def get_budget_by_month(session: Session) -> pd.DataFrame:
     Returns:
         DataFrame with columns: Month, PlannedAmount, ActualAmount, FileCount
     """
-    files = get_approved_files(session)
-    
-    month_data = {}
-    
-    for f in files:
-        month_key = f.uploaded_at.strftime('%Y-%m')
-        month_name = f.uploaded_at.strftime('%Y оны %m-р сар')
-        
-        if month_key not in month_data:
-            month_data[month_key] = {
-                'MonthName': month_name,
-                'PlannedAmount': Decimal(0),
-                'ActualAmount': Decimal(0),
-                'FileCount': 0
-            }
-        
-        month_data[month_key]['PlannedAmount'] += f.planned_amount or Decimal(0)
-        month_data[month_key]['ActualAmount'] += f.total_amount or Decimal(0)
-        month_data[month_key]['FileCount'] += 1
-    
-    if not month_data:
+    df = get_approved_files_df(session)
+    
+    if df.empty:
         return pd.DataFrame(columns=['Month', 'MonthName', 'PlannedAmount', 'ActualAmount', 'FileCount'])
     
-    df = pd.DataFrame([
-        {
-            'Month': month,
-            'MonthName': data['MonthName'],
-            'PlannedAmount': float(data['PlannedAmount']),
-            'ActualAmount': float(data['ActualAmount']),
-            'FileCount': data['FileCount']
-        }
-        for month, data in month_data.items()
-    ])
+    month = df['uploaded_at'].dt.strftime('%Y-%m').rename('Month')
+    df['MonthName'] = df['uploaded_at'].dt.strftime('%Y оны %m-р сар')
+    
+    result = df.groupby(month, sort=False).agg(
+        MonthName=('MonthName', 'first'),
+        PlannedAmount=('planned_amount', 'sum'),
+        ActualAmount=('total_amount', 'sum'),
+        FileCount=('planned_amount', 'size')
+    ).reset_index()
+    
+    return result.sort_values('Month')
+
+
+def extract_campaign_names(filenames: pd.Series) -> pd.Series:
+    """
+    Extract campaign names from filenames like "B2504E05_Campaign Name.xlsx".
     
-    return df.sort_values('Month')
+    Filenames without an underscore are returned unchanged.
+    """
+    names = filenames.str.partition('_')[2]
+    names = names.str.replace('.xlsx', '', regex=False).str.replace('.xls', '', regex=False)
+    return names.where(filenames.str.contains('_', regex=False), filenames)
 
 
 def get_top_campaigns(session: Session, limit: int = 10) -> pd.DataFrame:
@@ -175,46 +181,23 @@ def get_top_campaigns(session: Session, limit: int = 10) -> pd.DataFrame:
     Returns:
         DataFrame with columns: Campaign, BudgetCode, Company, ActualAmount, PlannedAmount
     """
-    files = get_approved_files(session)
-    
-    company_map = {
-        'A': 'Юнител',
-        'B': 'Юнивишн',
-        'G': 'Green Future',
-        'J': 'IVLBS',
-        'T': 'MPSC'
-    }
+    df = get_approved_files_df(session)
     
-    campaigns = []
-    for f in files:
-        # Extract campaign name from filename
-        filename = f.filename
-        campaign_name = filename
-        
-        # Try to extract campaign name from filename format: B2504E05_Campaign Name.xlsx
-        if '_' in filename:
-            parts = filename.split('_', 1)
-            if len(parts) > 1:
-                campaign_name = parts[1].replace('.xlsx', '').replace('.xls', '')
-        
-        company_code = f.budget_code[0].upper() if f.budget_code else 'X'
-        company_name = company_map.get(company_code, 'Other')
-        
-        campaigns.append({
-            'Campaign': campaign_name,
-            'BudgetCode': f.budget_code or 'N/A',
-            'Company': company_name,
-            'ActualAmount': float(f.total_amount or 0),
-            'PlannedAmount': float(f.planned_amount or 0)
-        })
-    
-    if not campaigns:
+    if df.empty:
         return pd.DataFrame(columns=['Campaign', 'BudgetCode', 'Company', 'ActualAmount', 'PlannedAmount'])
     
-    df = pd.DataFrame(campaigns)
-    df = df.sort_values('ActualAmount', ascending=False).head(limit)
+    budget_code = df['budget_code'].fillna('')
+    company_code = budget_code.str[:1].str.upper().where(budget_code != '', 'X')
     
-    return df
+    campaigns = pd.DataFrame({
+        'Campaign': extract_campaign_names(df['filename']),
+        'BudgetCode': budget_code.replace('', 'N/A'),
+        'Company': company_code.map(COMPANY_MAP).fillna('Other'),
+        'ActualAmount': df['total_amount'],
+        'PlannedAmount': df['planned_amount']
+    })
+    
+    return campaigns.sort_values('ActualAmount', ascending=False).head(limit)
 
 
 def get_budget_efficiency(session: Session) -> pd.DataFrame:
@@ -224,50 +207,36 @@ def get_budget_efficiency(session: Session) -> pd.DataFrame:
     Returns:
         DataFrame with columns: Campaign, BudgetCode, Planned, Actual, Efficiency, Status
     """
-    files = get_approved_files(session)
-    
-    data = []
-    for f in files:
-        planned = float(f.planned_amount or 0)
-        actual = float(f.total_amount or 0)
-        
-        if planned > 0:
-            efficiency = (actual / planned) * 100
-        else:
-            efficiency = 0
-        
-        # Determine status
-        if efficiency == 0:
-            status = '⚪ Өгөгдөл байхгүй'
-        elif efficiency <= 50:
-            status = '🟢 Маш хэмнэлттэй'
-        elif efficiency <= 80:
-            status = '🟡 Хэвийн'
-        elif efficiency <= 100:
-            status = '🟠 Хязгаарт ойр'
-        else:
-            status = '🔴 Хэтрүүлсэн'
-        
-        # Extract campaign name
-        filename = f.filename
-        if '_' in filename:
-            parts = filename.split('_', 1)
-            if len(parts) > 1:
-                filename = parts[1].replace('.xlsx', '').replace('.xls', '')
-        
-        data.append({
-            'Campaign': filename[:40] + '...' if len(filename) > 40 else filename,
-            'BudgetCode': f.budget_code or 'N/A',
-            'Planned': planned,
-            'Actual': actual,
-            'Efficiency': efficiency,
-            'Status': status
-        })
-    
-    if not data:
+    df = get_approved_files_df(session)
+    
+    if df.empty:
         return pd.DataFrame(columns=['Campaign', 'BudgetCode', 'Planned', 'Actual', 'Efficiency', 'Status'])
     
-    return pd.DataFrame(data).sort_values('Efficiency', ascending=False)
+    planned = df['planned_amount']
+    actual = df['total_amount']
+    efficiency = (actual / planned.where(planned > 0) * 100).fillna(0)
+    
+    # Determine status
+    status = np.select(
+        [efficiency == 0, efficiency <= 50, efficiency <= 80, efficiency <= 100],
+        ['⚪ Өгөгдөл байхгүй', '🟢 Маш хэмнэлттэй', '🟡 Хэвийн', '🟠 Хязгаарт ойр'],
+        default='🔴 Хэтрүүлсэн'
+    )
+    
+    # Extract campaign name
+    campaign = extract_campaign_names(df['filename'])
+    campaign = campaign.where(campaign.str.len() <= 40, campaign.str[:40] + '...')
+    
+    data = pd.DataFrame({
+        'Campaign': campaign,
+        'BudgetCode': df['budget_code'].fillna('').replace('', 'N/A'),
+        'Planned': planned,
+        'Actual': actual,
+        'Efficiency': efficiency,
+        'Status': status
+    })
+    
+    return data.sort_values('Efficiency', ascending=False)
 
 
 def get_status_distribution(session: Session) -> pd.DataFrame:
@@ -287,18 +256,13 @@ def get_status_distribution(session: Session) -> pd.DataFrame:
         FileStatus.FINALIZED: 'Дууссан',
     }
     
-    data = []
-    for status, count in results:
-        data.append({
-            'Status': status.value if hasattr(status, 'value') else str(status),
-            'StatusName': status_names.get(status, str(status)),
-            'Count': count
-        })
-    
-    if not data:
+    if not results:
         return pd.DataFrame(columns=['Status', 'StatusName', 'Count'])
     
-    return pd.DataFrame(data)
+    df = pd.DataFrame.from_records(results, columns=['Status', 'Count'])
+    df.insert(1, 'StatusName', df['Status'].map(lambda s: status_names.get(s, str(s))))
+    df['Status'] = df['Status'].map({status: status.value for status in FileStatus})
+    return df
 
 
 def export_cpp_summary(session: Session) -> Dict[str, pd.DataFrame]:
@@ -8,10 +8,10 @@ Only reads TEMPLATE or гүйцэтгэл sheets.
 Author: CPP Development Team
 """
 
-import hashlib
 import logging
 import re
 import warnings
+from functools import lru_cache
 from io import BytesIO
 from typing import Tuple, Optional, List, Dict, Any
 from datetime import datetime
@@ -19,6 +19,8 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 
+from modules.file_storage import calculate_file_hash, calculate_stream_hash
+
 # Suppress openpyxl Data Validation warnings
 warnings.filterwarnings('ignore', message='Data Validation extension is not supported')
 
@@ -26,6 +28,14 @@ warnings.filterwarnings('ignore', message='Data Validation extension is not supp
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Excel engine: python-calamine (Rust parser) when installed and supported by
+# pandas (2.2+), otherwise pandas' default (openpyxl)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine" if tuple(map(int, pd.__version__.split(".")[:2])) >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
 
 # =============================================================================
 # MAIN PROCESSING FUNCTION
@@ -34,7 +44,8 @@ logger = logging.getLogger(__name__)
 def process_uploaded_file(
     uploaded_file,
     budget_type: str,
-    sheet_name: str = None
+    sheet_name: str = None,
+    file_hash: Optional[str] = None
 ) -> Tuple[Optional[pd.DataFrame], Dict[str, Any], List[str]]:
     """
     Read Excel file exactly as it is from TEMPLATE or гүйцэтгэл sheet.
@@ -45,9 +56,13 @@ def process_uploaded_file(
         uploaded_file: Streamlit UploadedFile object or file path
         budget_type: Budget type (primary or additional)
         sheet_name: Sheet to process (auto-detect if None)
+        file_hash: MD5 of the content if the caller already computed it
+            (e.g. for a duplicate check before parsing)
     
     Returns:
-        Tuple of (DataFrame, metadata_dict, errors_list)
+        Tuple of (DataFrame, metadata_dict, errors_list); the metadata
+        carries validate_dataframe's result as "validation_issues", so
+        callers don't need to validate the DataFrame again
     """
     errors = []
     metadata = {
@@ -57,22 +72,20 @@ def process_uploaded_file(
         "budget_code": None,
         "row_count": 0,
         "total_amount": None,
-        "file_hash": None,
+        "file_hash": file_hash,
+        "validation_issues": [],
     }
     
     try:
-        # Get filename and content
+        # Get filename and hash the content in chunks (never held whole)
         if hasattr(uploaded_file, 'name'):
             metadata["filename"] = uploaded_file.name
-            file_content = uploaded_file.read()
-            uploaded_file.seek(0)
+            if file_hash is None:
+                metadata["file_hash"] = calculate_stream_hash(uploaded_file)
         else:
             metadata["filename"] = str(uploaded_file)
-            with open(uploaded_file, 'rb') as f:
-                file_content = f.read()
-        
-        # Calculate file hash
-        metadata["file_hash"] = hashlib.md5(file_content).hexdigest()
+            if file_hash is None:
+                metadata["file_hash"] = calculate_file_hash(uploaded_file)
         
         # Check file type
         filename_lower = metadata["filename"].lower()
@@ -84,9 +97,7 @@ def process_uploaded_file(
         try:
             if hasattr(uploaded_file, 'read'):
                 uploaded_file.seek(0)
-                xl = pd.ExcelFile(uploaded_file)
-            else:
-                xl = pd.ExcelFile(uploaded_file)
+            xl = pd.ExcelFile(uploaded_file, engine=EXCEL_ENGINE)
         except Exception as e:
             errors.append(f"Excel файл уншихад алдаа: {str(e)}")
             return None, metadata, errors
@@ -184,6 +195,8 @@ def process_uploaded_file(
         except:
             pass
         
+        metadata["validation_issues"] = validate_dataframe(df)
+        
         logger.info(f"Successfully read {metadata['row_count']} rows from {target_sheet}")
         
         return df, metadata, errors
@@ -208,7 +221,7 @@ def get_file_preview(uploaded_file, max_rows: int = 20) -> Tuple[pd.DataFrame, L
         if hasattr(uploaded_file, 'seek'):
             uploaded_file.seek(0)
         
-        xl = pd.ExcelFile(uploaded_file)
+        xl = pd.ExcelFile(uploaded_file, engine=EXCEL_ENGINE)
         sheet_names = xl.sheet_names
         
         # Find the right sheet
@@ -237,14 +250,14 @@ def get_file_preview(uploaded_file, max_rows: int = 20) -> Tuple[pd.DataFrame, L
         if target_sheet is None:
             target_sheet = sheet_names[0]
         
-        # Read sheet
-        df = pd.read_excel(xl, sheet_name=target_sheet, header=None)
+        # Read only the preview rows
+        df = pd.read_excel(xl, sheet_name=target_sheet, header=None, nrows=max_rows)
         
         # Convert all to string
         for col in df.columns:
             df[col] = df[col].apply(lambda x: str(x) if pd.notna(x) else "")
         
-        return df.head(max_rows), sheet_names
+        return df, sheet_names
         
     except Exception as e:
         logger.error(f"Preview error: {str(e)}")
@@ -283,42 +296,83 @@ def dataframe_to_budget_items(
     if not specialist_username:
         raise ValueError("specialist_username is required")
     
-    items = []
+    # Row numbers: the 'Мөр' column if present, otherwise 1-based position
+    if 'Мөр' in df.columns:
+        row_numbers = df['Мөр'].tolist()
+    else:
+        row_numbers = (df.index + 1).tolist()
+    
+    # Cell text per column, computed once for the whole frame
+    cell_text = df.astype(object).astype(str)
+    
+    # Store row content as description (first 5 non-empty columns)
+    content_cols = [col for col in df.columns if col != 'Мөр']
+    has_content = (
+        df[content_cols].notna() & (cell_text[content_cols].apply(lambda col: col.str.strip()) != '')
+    ).to_numpy(dtype=bool)
+    content_text = cell_text[content_cols].to_numpy()
+    descriptions = [
+        " | ".join(text[mask][:5]) for text, mask in zip(content_text, has_content)
+    ]
     
-    for idx, row in df.iterrows():
-        # Create item with row data
+    # Try to find amount: first cell in the row that parses to > 10000
+    number_text = cell_text.apply(
+        lambda col: col.str.replace(',', '', regex=False).str.replace(' ', '', regex=False).str.strip()
+    )
+    amounts = number_text.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    is_amount = amounts > 10000  # Likely a budget amount
+    has_amount = is_amount.any(axis=1)
+    if has_amount.any():
+        # Re-parse just the chosen cell with float() so the value is exact
+        first_amount = number_text.to_numpy()[np.arange(len(df)), is_amount.argmax(axis=1)]
+    
+    items = []
+    for i, (row_number, description) in enumerate(zip(row_numbers, descriptions)):
         item = {
             "file_id": file_id,
             "specialist": specialist_username,
-            "row_number": row.get('Мөр', idx + 1),
+            "row_number": row_number,
+            "description": description,
         }
-        
-        # Store row content as description (concatenate all columns)
-        row_content = []
-        for col in df.columns:
-            if col != 'Мөр':
-                val = row[col]
-                if pd.notna(val) and str(val).strip():
-                    row_content.append(str(val))
-        
-        item["description"] = " | ".join(row_content[:5])  # First 5 columns
-        
-        # Try to find amount
-        for col in df.columns:
-            try:
-                val = str(row[col]).replace(',', '').replace(' ', '')
-                num_val = float(val)
-                if num_val > 10000:  # Likely a budget amount
-                    item["amount_planned"] = num_val
-                    break
-            except:
-                continue
-        
+        if has_amount[i]:
+            item["amount_planned"] = float(first_amount[i])
         items.append(item)
     
     return items
 
 
+# =============================================================================
+# FILENAME HEURISTICS
+# =============================================================================
+
+# Budget code in a filename like "B2506E04_TOKI MOVIE.xlsx" or "ТК-001"
+BUDGET_CODE_PATTERN = re.compile(r'([A-Z]\d{4}[A-Z]\d{2}|[A-Za-z0-9]+-\d+-\d+|[A-Za-z]{2,}-\d+)')
+
+
+@lru_cache(maxsize=512)
+def extract_metadata_from_filename(filename: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Guess budget code and brand from an upload's filename.
+    
+    Used as a fallback when the Excel sheet itself has no code/brand.
+    Memoized per filename for the life of the process.
+    
+    Args:
+        filename: Original filename, e.g. "B2506E04_TOKI MOVIE.xlsx"
+    
+    Returns:
+        Tuple of (budget_code, brand), None where not found
+    """
+    match = BUDGET_CODE_PATTERN.search(filename)
+    budget_code = match.group(1) if match else None
+    
+    # Brand is the first part before an underscore
+    name_parts = filename.replace('.xlsx', '').replace('.xls', '').split('_')
+    brand = name_parts[0] if len(name_parts) > 1 else None
+    
+    return budget_code, brand
+
+
 # =============================================================================
 # LEGACY STUBS
 # =============================================================================
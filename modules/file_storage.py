@@ -10,11 +10,19 @@ Author: CPP Development Team
 
 import os
 import hashlib
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
-from config import SIGNED_FILES_DIR, ALLOWED_SIGNED_FILE_TYPES
+from config import (
+    SIGNED_FILES_DIR,
+    ALLOWED_SIGNED_FILE_TYPES,
+    STATIC_PREVIEWS,
+    STATIC_PREVIEW_DIR
+)
 
 
 # =============================================================================
@@ -82,27 +90,58 @@ def save_signed_document(
         with open(file_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
         
-        # Calculate file hash for verification
-        file_hash = calculate_file_hash(file_path)
-        
         return True, file_path, f"File saved successfully: {new_filename}"
         
     except Exception as e:
         return False, None, f"Error saving file: {str(e)}"
 
 
+# Chunk size for streaming hashes (1 MB)
+HASH_CHUNK_SIZE = 1 << 20
+
+
 def calculate_file_hash(file_path: str) -> str:
     """Calculate MD5 hash of a file."""
+    with open(file_path, "rb") as f:
+        return calculate_stream_hash(f)
+
+
+def calculate_stream_hash(file_obj) -> str:
+    """
+    Calculate MD5 hash of a file-like object without loading it whole.
+    
+    Reads from the start in HASH_CHUNK_SIZE chunks and rewinds afterwards,
+    so the object can be read again (e.g. a Streamlit UploadedFile).
+    
+    Args:
+        file_obj: Binary file-like object supporting seek/read
+    
+    Returns:
+        Hex digest string
+    """
     md5_hash = hashlib.md5()
     
-    with open(file_path, "rb") as f:
-        # Read in chunks to handle large files
-        for chunk in iter(lambda: f.read(4096), b""):
-            md5_hash.update(chunk)
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+        md5_hash.update(chunk)
+    file_obj.seek(0)
     
     return md5_hash.hexdigest()
 
 
+def calculate_bytes_hash(data: bytes) -> str:
+    """
+    Calculate MD5 hash of content that is already in memory.
+    
+    Args:
+        data: File content
+    
+    Returns:
+        Hex digest string (same as calculate_stream_hash for the same content)
+    """
+    return hashlib.md5(data).hexdigest()
+
+
 def delete_signed_document(file_path: str) -> bool:
     """
     Delete a signed document from disk.
@@ -211,10 +250,10 @@ def save_excel_file(
         # Full path
         file_path = os.path.join(UPLOADED_FILES_DIR, new_filename)
         
-        # Save file (exact copy)
+        # Save file (exact copy, copied in chunks rather than one big read)
         uploaded_file.seek(0)
         with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, f)
         
         return True, file_path, f"File saved: {new_filename}"
         
@@ -321,11 +360,31 @@ def read_excel_file_bytes(file_path: str):
     Returns:
         File bytes or None
     """
-    if not os.path.exists(file_path):
+    excel_file = open_file_or_none(file_path)
+    if excel_file is None:
         return None
     
-    with open(file_path, "rb") as f:
-        return f.read()
+    with excel_file:
+        return excel_file.read()
+
+
+def open_file_or_none(file_path: Optional[str]):
+    """
+    Open a file for binary reading without a separate existence check.
+    
+    Args:
+        file_path: Path to file (may be None)
+    
+    Returns:
+        Open binary file object (caller must close it) or None
+    """
+    if not file_path:
+        return None
+    
+    try:
+        return open(file_path, "rb")
+    except OSError:
+        return None
 
 
 def pdf_exists(file_id: int) -> bool:
@@ -352,6 +411,22 @@ def get_preview_pdf_path(file_id: int) -> str:
     return os.path.join(preview_dir, filename)
 
 
+# Shared pool for Excel -> PDF preview conversions (lives for the process,
+# not per Streamlit rerun)
+PREVIEW_MAX_WORKERS = 4
+_preview_pool = ThreadPoolExecutor(max_workers=PREVIEW_MAX_WORKERS)
+
+# Per-file locks so two reruns never convert the same file at once
+_preview_locks: Dict[int, threading.Lock] = {}
+_preview_locks_guard = threading.Lock()
+
+
+def _get_preview_lock(file_id: int) -> threading.Lock:
+    """Get (or create) the conversion lock for a file."""
+    with _preview_locks_guard:
+        return _preview_locks.setdefault(file_id, threading.Lock())
+
+
 def create_preview_pdf(excel_path: str, file_id: int) -> Optional[str]:
     """
     Create a PDF preview from Excel file.
@@ -365,7 +440,7 @@ def create_preview_pdf(excel_path: str, file_id: int) -> Optional[str]:
     """
     from modules.pdf_converter import convert_excel_to_pdf
     
-    if not os.path.exists(excel_path):
+    if not excel_path or not os.path.exists(excel_path):
         return None
     
     pdf_path = get_preview_pdf_path(file_id)
@@ -374,17 +449,83 @@ def create_preview_pdf(excel_path: str, file_id: int) -> Optional[str]:
     if os.path.exists(pdf_path):
         return pdf_path
     
-    # Convert Excel to PDF
-    try:
-        success = convert_excel_to_pdf(excel_path, pdf_path)
-        if success and os.path.exists(pdf_path):
+    with _get_preview_lock(file_id):
+        # Another thread may have finished the conversion while we waited
+        if os.path.exists(pdf_path):
             return pdf_path
-    except Exception as e:
-        print(f"Error creating preview PDF: {e}")
+        
+        # Convert Excel to PDF
+        try:
+            success = convert_excel_to_pdf(excel_path, pdf_path)
+            if success and os.path.exists(pdf_path):
+                return pdf_path
+        except Exception as e:
+            print(f"Error creating preview PDF: {e}")
     
     return None
 
 
+def submit_preview_pdf(excel_path: str, file_id: int) -> Future:
+    """
+    Start creating a PDF preview in the background.
+    
+    The conversion keeps running even if the page reruns or the user
+    navigates away, so the preview is ready for the next viewer.
+    
+    Args:
+        excel_path: Path to Excel file
+        file_id: BudgetFile ID
+    
+    Returns:
+        Future resolving to the PDF path (None if conversion failed)
+    """
+    return _preview_pool.submit(create_preview_pdf, excel_path, file_id)
+
+
+def create_preview_pdfs(jobs: List[Tuple[str, int]]) -> Dict[int, Optional[str]]:
+    """
+    Create several PDF previews concurrently.
+    
+    Args:
+        jobs: List of (excel_path, file_id) pairs
+    
+    Returns:
+        Dictionary mapping file_id to PDF path (None if conversion failed)
+    """
+    futures = {
+        submit_preview_pdf(excel_path, file_id): file_id
+        for excel_path, file_id in jobs
+    }
+    
+    results = {}
+    for future in as_completed(futures):
+        results[futures[future]] = future.result()
+    
+    return results
+
+
+def read_pdf_bytes(pdf_path: str) -> Optional[bytes]:
+    """
+    Read a PDF file and return its raw bytes.
+    
+    Args:
+        pdf_path: Path to PDF file
+    
+    Returns:
+        File bytes or None
+    """
+    pdf_file = open_file_or_none(pdf_path)
+    if pdf_file is None:
+        return None
+    
+    try:
+        with pdf_file:
+            return pdf_file.read()
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        return None
+
+
 def read_pdf_as_base64(pdf_path: str) -> Optional[str]:
     """
     Read a PDF file and return as base64 encoded string.
@@ -397,16 +538,69 @@ def read_pdf_as_base64(pdf_path: str) -> Optional[str]:
     """
     import base64
     
-    if not os.path.exists(pdf_path):
+    pdf_bytes = read_pdf_bytes(pdf_path)
+    if pdf_bytes is None:
         return None
     
+    return base64.b64encode(pdf_bytes).decode('utf-8')
+
+
+# Streamlit serves the static folder next to the main script, regardless of
+# the working directory the app was started from
+_STATIC_PREVIEW_PATH = Path(__file__).resolve().parent.parent / STATIC_PREVIEW_DIR
+
+
+def publish_preview_pdf(pdf_path: str, file_id: int) -> Optional[str]:
+    """
+    Publish a preview PDF under Streamlit's static folder.
+    
+    Lets the browser load the PDF by URL instead of a base64 data URI
+    embedded in the page HTML. Only active when STATIC_PREVIEWS is enabled.
+    
+    Args:
+        pdf_path: Path to the preview PDF
+        file_id: BudgetFile ID
+    
+    Returns:
+        Relative URL for an iframe src, or None if static serving is off
+        or the file could not be published
+    """
+    if not STATIC_PREVIEWS:
+        return None
+    
+    static_path = _STATIC_PREVIEW_PATH / f"{file_id}.pdf"
     try:
-        with open(pdf_path, "rb") as f:
-            pdf_bytes = f.read()
-        return base64.b64encode(pdf_bytes).decode('utf-8')
-    except Exception as e:
-        print(f"Error reading PDF: {e}")
+        version = int(os.path.getmtime(pdf_path))
+        # Copy only when the preview was (re)generated since the last publish
+        if not static_path.exists() or static_path.stat().st_mtime < version:
+            _STATIC_PREVIEW_PATH.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(pdf_path, static_path)
+    except OSError as e:
+        print(f"Error publishing preview PDF: {e}")
         return None
+    
+    # ?v= busts the browser cache when the preview is regenerated
+    return f"app/{STATIC_PREVIEW_DIR}/{file_id}.pdf?v={version}"
+
+
+def unpublish_preview_pdf(file_id: int) -> bool:
+    """
+    Remove a file's published preview from Streamlit's static folder.
+    
+    Called when the budget file is deleted, so the PDF is no longer
+    reachable by its static URL.
+    
+    Args:
+        file_id: BudgetFile ID
+    
+    Returns:
+        True if a published copy was removed, False otherwise
+    """
+    try:
+        (_STATIC_PREVIEW_PATH / f"{file_id}.pdf").unlink()
+        return True
+    except OSError:
+        return False
 
 
 def preview_pdf_exists(file_id: int) -> bool:
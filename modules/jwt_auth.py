@@ -292,6 +292,34 @@ def get_current_user_from_token() -> Optional[Dict[str, Any]]:
     return user_info
 
 
+def get_current_db_user(jwt_user: Dict[str, Any]):
+    """
+    Get the database User for the JWT user, cached in session state.
+    
+    The row is fetched once per login and detached from its session, so
+    reruns do not hit the database just to rebuild the User object.
+    
+    Args:
+        jwt_user: User dict returned by get_current_user_from_token()
+    
+    Returns:
+        User object or None if not found
+    """
+    cached_user = st.session_state.get("jwt_db_user")
+    if cached_user is not None and str(cached_user.id) == str(jwt_user["id"]):
+        return cached_user
+    
+    from database import get_session, User
+    
+    with get_session() as session:
+        user = session.get(User, int(jwt_user["id"]))
+        if user:
+            session.expunge(user)
+    
+    st.session_state["jwt_db_user"] = user
+    return user
+
+
 def login_with_jwt(user) -> str:
     """
     Create JWT token and set session after successful authentication.
@@ -329,6 +357,7 @@ def login_with_jwt(user) -> str:
     # Update session state
     st.session_state["jwt_authenticated"] = True
     st.session_state["jwt_user"] = user_info
+    st.session_state["jwt_db_user"] = None
     
     return token
 
@@ -338,6 +367,7 @@ def logout_jwt():
     clear_auth_cookie()
     st.session_state["jwt_authenticated"] = False
     st.session_state["jwt_user"] = None
+    st.session_state["jwt_db_user"] = None
     
     # Clear legacy session state
     if "authenticated" in st.session_state:
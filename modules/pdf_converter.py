@@ -271,9 +271,17 @@ def _convert_with_libreoffice(input_path: str, output_path: str) -> bool:
         expected_pdf_name = os.path.splitext(input_filename)[0] + ".pdf"
         expected_pdf_path = os.path.join(output_dir, expected_pdf_name)
         
+        # Thread бүрт тусдаа profile - зэрэг ажиллах LibreOffice процессууд
+        # нэг profile дээр түгжигдэхээс сэргийлнэ
+        import tempfile
+        profile_dir = os.path.join(
+            tempfile.gettempdir(), f"bap_lo_profile_{threading.get_ident()}"
+        )
+        
         # LibreOffice команд
         command = [
             "libreoffice",
+            f"-env:UserInstallation=file://{profile_dir}",
             "--headless",
             "--convert-to", "pdf",
             "--outdir", output_dir,
@@ -20,10 +20,9 @@ Author: CPP Development Team
 import re
 import logging
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Any, List, Dict, Optional, Tuple
 from datetime import datetime
 
-import openpyxl
 from sqlmodel import select
 
 from database import (
@@ -241,6 +240,32 @@ CATEGORY_HEADER_PATTERN = re.compile(r'^\d{1,2}\.\s*(.+)$')
 # SEEDER FUNCTIONS
 # =============================================================================
 
+def _insert_missing(session, model, keys: Tuple[str, ...], rows: List[Dict[str, Any]]) -> int:
+    """
+    Insert the rows whose key columns don't match an existing record.
+    
+    Existing keys are read in one SELECT and the new rows go in as one
+    executemany INSERT (reference tables are small, so all keys are read).
+    Rows repeating a key within `rows` are inserted once.
+    
+    Returns:
+        Number of rows inserted
+    """
+    key_columns = [getattr(model, key) for key in keys]
+    seen = {tuple(existing) for existing in session.execute(select(*key_columns)).all()}
+    
+    new_rows = []
+    for row in rows:
+        row_key = tuple(row[key] for key in keys)
+        if row_key not in seen:
+            seen.add(row_key)
+            new_rows.append(row)
+    
+    if new_rows:
+        session.execute(model.__table__.insert(), new_rows)
+    return len(new_rows)
+
+
 def seed_budget_codes(excel_path: str, sheet_name: str = "GENERAL") -> int:
     """
     Seed BudgetCodeRef table from the GENERAL sheet.
@@ -254,6 +279,8 @@ def seed_budget_codes(excel_path: str, sheet_name: str = "GENERAL") -> int:
     """
     logger.info(f"📋 Seeding Budget Codes from '{sheet_name}' sheet...")
     
+    import openpyxl  # Only needed when seeding
+    
     try:
         wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
     except Exception as e:
@@ -289,25 +316,17 @@ def seed_budget_codes(excel_path: str, sheet_name: str = "GENERAL") -> int:
     
     wb.close()
     
-    # Save to database
-    count = 0
+    # Save to database (new codes only)
     with get_session() as session:
-        for code_data in codes_found:
-            # Check if already exists
-            existing = session.exec(
-                select(BudgetCodeRef).where(BudgetCodeRef.code == code_data["code"])
-            ).first()
-            
-            if not existing:
-                budget_code = BudgetCodeRef(
-                    code=code_data["code"],
-                    description=code_data.get("description"),
-                    year=2025,
-                    is_active=True
-                )
-                session.add(budget_code)
-                count += 1
-        
+        count = _insert_missing(session, BudgetCodeRef, ("code",), [
+            {
+                "code": code_data["code"],
+                "description": code_data.get("description"),
+                "year": 2025,
+                "is_active": True,
+            }
+            for code_data in codes_found
+        ])
         session.commit()
     
     logger.info(f"✅ Seeded {count} new budget codes (found {len(codes_found)} total)")
@@ -367,33 +386,23 @@ def seed_channel_activities(category_map: Dict[str, int]) -> int:
     """
     logger.info("📋 Seeding Channel Activities from hardcoded data...")
     
-    count = 0
-    with get_session() as session:
-        for category_name, activities in KNOWN_ACTIVITIES.items():
-            # Find category ID
-            category_id = category_map.get(category_name)
-            if not category_id:
-                logger.warning(f"⚠️ Category not found: {category_name}")
-                continue
-            
-            for activity_name in activities:
-                # Check if already exists
-                existing = session.exec(
-                    select(ChannelActivity).where(
-                        ChannelActivity.category_id == category_id,
-                        ChannelActivity.name == activity_name
-                    )
-                ).first()
-                
-                if not existing:
-                    activity = ChannelActivity(
-                        category_id=category_id,
-                        name=activity_name,
-                        is_active=True
-                    )
-                    session.add(activity)
-                    count += 1
+    rows = []
+    for category_name, activities in KNOWN_ACTIVITIES.items():
+        # Find category ID
+        category_id = category_map.get(category_name)
+        if not category_id:
+            logger.warning(f"⚠️ Category not found: {category_name}")
+            continue
         
+        for activity_name in activities:
+            rows.append({
+                "category_id": category_id,
+                "name": activity_name,
+                "is_active": True,
+            })
+    
+    with get_session() as session:
+        count = _insert_missing(session, ChannelActivity, ("category_id", "name"), rows)
         session.commit()
     
     total_activities = sum(len(acts) for acts in KNOWN_ACTIVITIES.values())
@@ -410,22 +419,11 @@ def seed_campaign_types() -> int:
     """
     logger.info("📋 Seeding Campaign Types...")
     
-    count = 0
     with get_session() as session:
-        for order, name in enumerate(KNOWN_CAMPAIGN_TYPES, 1):
-            existing = session.exec(
-                select(CampaignType).where(CampaignType.name == name)
-            ).first()
-            
-            if not existing:
-                campaign_type = CampaignType(
-                    name=name,
-                    display_order=order,
-                    is_active=True
-                )
-                session.add(campaign_type)
-                count += 1
-        
+        count = _insert_missing(session, CampaignType, ("name",), [
+            {"name": name, "display_order": order, "is_active": True}
+            for order, name in enumerate(KNOWN_CAMPAIGN_TYPES, 1)
+        ])
         session.commit()
     
     logger.info(f"✅ Seeded {count} new campaign types (total defined: {len(KNOWN_CAMPAIGN_TYPES)})")
@@ -441,23 +439,11 @@ def seed_products_services() -> int:
     """
     logger.info("📋 Seeding Products & Services...")
     
-    count = 0
     with get_session() as session:
-        for order, (name, description) in enumerate(KNOWN_PRODUCTS_SERVICES, 1):
-            existing = session.exec(
-                select(ProductService).where(ProductService.name == name)
-            ).first()
-            
-            if not existing:
-                product = ProductService(
-                    name=name,
-                    description=description,
-                    display_order=order,
-                    is_active=True
-                )
-                session.add(product)
-                count += 1
-        
+        count = _insert_missing(session, ProductService, ("name",), [
+            {"name": name, "description": description, "display_order": order, "is_active": True}
+            for order, (name, description) in enumerate(KNOWN_PRODUCTS_SERVICES, 1)
+        ])
         session.commit()
     
     logger.info(f"✅ Seeded {count} new products (total defined: {len(KNOWN_PRODUCTS_SERVICES)})")
@@ -473,23 +459,11 @@ def seed_approvers() -> int:
     """
     logger.info("📋 Seeding Approvers...")
     
-    count = 0
     with get_session() as session:
-        for name, position, level in KNOWN_APPROVERS:
-            existing = session.exec(
-                select(Approver).where(Approver.name == name)
-            ).first()
-            
-            if not existing:
-                approver = Approver(
-                    name=name,
-                    position=position,
-                    approval_level=level,
-                    is_active=True
-                )
-                session.add(approver)
-                count += 1
-        
+        count = _insert_missing(session, Approver, ("name",), [
+            {"name": name, "position": position, "approval_level": level, "is_active": True}
+            for name, position, level in KNOWN_APPROVERS
+        ])
         session.commit()
     
     logger.info(f"✅ Seeded {count} new approvers (total defined: {len(KNOWN_APPROVERS)})")
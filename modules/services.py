@@ -12,15 +12,39 @@ All functions use the session context manager for proper transaction handling.
 Author: CPP Development Team
 """
 
+import os
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import Callable, Generator, List, Optional, Dict, Any, Tuple
 from decimal import Decimal
 
-from sqlmodel import select, func
+from sqlmodel import Session, select, func
 from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 
 from config import FileStatus, UserRole, ChannelType, BudgetType
 from database import get_session, User, BudgetFile, BudgetItem
+from modules.file_storage import unpublish_preview_pdf
+
+
+@contextmanager
+def _session_scope(session: Optional[Session] = None) -> Generator[Session, None, None]:
+    """Use the caller's session if given, otherwise open (and commit) a new one."""
+    if session is not None:
+        yield session
+    else:
+        with get_session() as new_session:
+            yield new_session
+
+
+def _remove_stored_file(file_path: Optional[str]) -> None:
+    """Delete a file stored for a record whose insert was rolled back."""
+    if not file_path:
+        return
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
 
 
 # =============================================================================
@@ -39,8 +63,11 @@ def create_budget_file(
     brand: Optional[str] = None,
     campaign_name: Optional[str] = None,
     specialist_name: Optional[str] = None,
-    parent_file_id: Optional[int] = None
-) -> BudgetFile:
+    parent_file_id: Optional[int] = None,
+    unique_hash: bool = False,
+    store_file: Optional[Callable[[int], str]] = None,
+    session: Optional[Session] = None
+) -> Optional[BudgetFile]:
     """
     Create a new budget file record.
     
@@ -57,14 +84,31 @@ def create_budget_file(
         campaign_name: Official campaign name (required for PRIMARY)
         specialist_name: Marketing specialist/planner name
         parent_file_id: Parent PRIMARY file ID (for ADDITIONAL budgets)
+        unique_hash: Skip the insert if a file with the same hash exists.
+            The SELECT before the insert is only an early exit; concurrent
+            uploads are caught by the unique file_hash index, whose
+            IntegrityError is reported as a duplicate too
+        store_file: Called with the new file ID before commit; returns the
+            stored Excel path, written to pdf_file_path in the same
+            transaction (INSERT on flush, UPDATE on commit).
+            If it raises, the record is rolled back; if the commit fails,
+            the stored file is deleted again.
+        session: Existing session to run in (e.g. shared with the
+            duplicate check of the same upload); a new one if None
     
     Returns:
-        Created BudgetFile object with ID
+        Created BudgetFile object with ID, or None if unique_hash is set
+        and the file is a duplicate
     """
     from datetime import datetime, timezone, timedelta
     mongolia_tz = timezone(timedelta(hours=8))  # UTC+8
     
-    with get_session() as session:
+    with _session_scope(session) as session:
+        if unique_hash and file_hash:
+            statement = select(BudgetFile.id).where(BudgetFile.file_hash == file_hash)
+            if session.exec(statement).first() is not None:
+                return None
+        
         budget_file = BudgetFile(
             filename=filename,
             budget_type=BudgetType(budget_type),
@@ -82,7 +126,27 @@ def create_budget_file(
             uploaded_at=datetime.now(mongolia_tz).replace(tzinfo=None),
         )
         session.add(budget_file)
-        session.commit()
+        stored_path = None
+        try:
+            if store_file:
+                session.flush()  # Assigns the ID without committing
+                stored_path = store_file(budget_file.id)  # Excel path
+                budget_file.pdf_file_path = stored_path
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            _remove_stored_file(stored_path)
+            # Only a hash conflict (same file inserted by a concurrent upload
+            # since the check above) counts as a duplicate; anything else,
+            # e.g. a bad parent_file_id, is a real error
+            if unique_hash and file_hash and check_duplicate_file(file_hash, session=session) is not None:
+                return None
+            raise
+        except Exception:
+            # Don't leave the flushed record behind in a caller's session
+            session.rollback()
+            _remove_stored_file(stored_path)
+            raise
         session.refresh(budget_file)
         return budget_file
 
@@ -124,6 +188,35 @@ def get_budget_files_by_uploader(
         return session.exec(statement).all()
 
 
+def get_files_by_uploader_grouped(
+    uploader_id: int
+) -> Tuple[List[BudgetFile], Dict[FileStatus, List[BudgetFile]]]:
+    """
+    Get all budget files of an uploader in one query, also grouped by status.
+
+    The full list and each group keep newest-first upload order.
+
+    Args:
+        uploader_id: ID of the uploading user
+
+    Returns:
+        Tuple of (all files, dictionary mapping FileStatus to list of BudgetFile)
+    """
+    with get_session() as session:
+        statement = (
+            select(BudgetFile)
+            .where(BudgetFile.uploader_id == uploader_id)
+            .order_by(BudgetFile.uploaded_at.desc())
+        )
+        files = session.exec(statement).all()
+
+    grouped: Dict[FileStatus, List[BudgetFile]] = {status: [] for status in FileStatus}
+    for budget_file in files:
+        grouped[budget_file.status].append(budget_file)
+
+    return files, grouped
+
+
 def update_budget_file_status(
     file_id: int,
     new_status: FileStatus,
@@ -171,10 +264,19 @@ def update_budget_file_status(
         return budget_file
 
 
-def check_duplicate_file(file_hash: str) -> Optional[BudgetFile]:
-    """Check if a file with the same hash already exists."""
-    with get_session() as session:
-        statement = select(BudgetFile).where(BudgetFile.file_hash == file_hash)
+def check_duplicate_file(file_hash: str, session: Optional[Session] = None) -> Optional[int]:
+    """
+    Check if a file with the same hash already exists.
+    
+    Args:
+        file_hash: MD5 hash of the uploaded content
+        session: Existing session to run in; a new one if None
+    
+    Returns:
+        ID of the existing file, or None
+    """
+    with _session_scope(session) as session:
+        statement = select(BudgetFile.id).where(BudgetFile.file_hash == file_hash)
         return session.exec(statement).first()
 
 
@@ -193,6 +295,7 @@ def delete_budget_file(file_id: int) -> bool:
         if budget_file:
             session.delete(budget_file)  # Cascade deletes items
             session.commit()
+            unpublish_preview_pdf(file_id)
             return True
         
         return False
@@ -202,35 +305,51 @@ def delete_budget_file(file_id: int) -> bool:
 # BUDGET ITEM OPERATIONS
 # =============================================================================
 
-def create_budget_items_bulk(items: List[Dict[str, Any]]) -> int:
+def create_budget_items_bulk(
+    items: List[Dict[str, Any]],
+    session: Optional[Session] = None
+) -> int:
     """
     Bulk insert budget items.
     
+    Rows go straight to a Core INSERT executemany (no ORM objects); the
+    driver batches them into multi-VALUES statements (insertmanyvalues).
+    
     Args:
         items: List of dictionaries with item data
+        session: Existing session to run in; a new one if None
     
     Returns:
         Number of items created
     """
-    with get_session() as session:
-        budget_items = []
+    rows = []
+    for item_data in items:
+        row = dict(item_data)
         
-        for item_data in items:
-            # Convert channel string to enum if needed
-            if isinstance(item_data.get('channel'), str):
-                item_data['channel'] = ChannelType(item_data['channel'])
-            
-            # Convert amount to Decimal if needed
-            if item_data.get('amount_planned') is not None:
-                item_data['amount_planned'] = Decimal(str(item_data['amount_planned']))
-            
-            budget_item = BudgetItem(**item_data)
-            budget_items.append(budget_item)
+        # Convert channel string to enum if needed
+        if isinstance(row.get('channel'), str):
+            row['channel'] = ChannelType(row['channel'])
         
-        session.add_all(budget_items)
-        session.commit()
+        # Convert amount to Decimal if needed
+        if row.get('amount_planned') is not None:
+            row['amount_planned'] = Decimal(str(row['amount_planned']))
         
-        return len(budget_items)
+        rows.append(row)
+    
+    # executemany needs the same keys in every row; items are normally
+    # uniform, so this is usually a single statement
+    rows_by_keys: Dict[frozenset, List[Dict[str, Any]]] = {}
+    for row in rows:
+        rows_by_keys.setdefault(frozenset(row), []).append(row)
+    
+    created = 0
+    with _session_scope(session) as session:
+        for same_key_rows in rows_by_keys.values():
+            result = session.execute(BudgetItem.__table__.insert(), same_key_rows)
+            created += result.rowcount
+        session.commit()
+    
+    return created
 
 
 def get_budget_items_by_file(file_id: int) -> List[BudgetItem]:
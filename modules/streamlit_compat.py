@@ -0,0 +1,23 @@
+"""
+Streamlit Compatibility Helpers for CPP
+========================================
+
+Shims for Streamlit APIs that are not available in every supported version.
+
+Author: CPP Development Team
+"""
+
+import streamlit as st
+
+
+def _render_inline(func=None, **kwargs):
+    """Fallback for @fragment and @fragment(run_every=...): no partial reruns."""
+    if func is None:
+        return _render_inline
+    return func
+
+
+# Partial reruns (st.fragment needs Streamlit 1.37+, experimental_fragment 1.33+);
+# older versions simply render the function as part of the full page, and
+# run_every timers do not fire
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or _render_inline
@@ -9,7 +9,8 @@ Author: CPP Development Team
 
 import streamlit as st
 import pandas as pd
-import os
+import pyarrow as pa
+import base64
 from datetime import datetime
 
 # Page configuration
@@ -21,22 +22,87 @@ st.set_page_config(
 
 # Import our modules
 from config import FileStatus, UserRole
-from database import get_session, User, BudgetFile
-from modules.jwt_auth import get_current_user_from_token
+from database import User, BudgetFile
+from modules.jwt_auth import get_current_user_from_token, get_current_db_user
+from modules.streamlit_compat import fragment
 from modules.services import (
     get_files_pending_approval,
+    get_files_by_uploader_grouped,
     update_budget_file_status
 )
 from modules.file_storage import (
     get_excel_file_path, 
     read_excel_file, 
-    read_excel_file_bytes,
+    open_file_or_none,
     create_preview_pdf,
-    read_pdf_as_base64,
+    create_preview_pdfs,
+    read_pdf_bytes,
     preview_pdf_exists,
-    get_preview_pdf_path
+    get_preview_pdf_path,
+    publish_preview_pdf
 )
 
+# Maximum rows loaded for the fallback Excel preview
+PREVIEW_MAX_ROWS = 200
+
+# Default specialists list
+DEFAULT_SPECIALISTS = (
+    "Н. Энх-Өлзий",
+    "Д. Эгшиглэн",
+    "Ц. Содномцэрэн",
+    "М. Золзаяа",
+    "А. Жавхлан",
+    "М. Наранцацрал",
+    "Б. Наранцэцэг"
+)
+
+# Status display mappings for the planner view
+STATUS_EMOJI = {
+    FileStatus.PENDING_APPROVAL: "🕐",
+    FileStatus.APPROVED_FOR_PRINT: "✅",
+    FileStatus.SIGNING: "📝",
+    FileStatus.FINALIZED: "🏁",
+    FileStatus.REJECTED: "❌"
+}
+
+STATUS_TEXT = {
+    FileStatus.PENDING_APPROVAL: "Хүлээгдэж байгаа",
+    FileStatus.APPROVED_FOR_PRINT: "Батлагдсан",
+    FileStatus.SIGNING: "Гарын үсэг зурж байна",
+    FileStatus.FINALIZED: "Дууссан",
+    FileStatus.REJECTED: "Буцаагдсан"
+}
+
+
+def format_amount(amount) -> str:
+    """Format a money amount as ₮ with thousands separators, or N/A."""
+    if not amount:
+        return "N/A"
+    return f"₮{float(amount):,.0f}"
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def load_excel_preview(excel_path: str, file_hash: str = None) -> pa.Table:
+    """
+    Read the first rows of a stored Excel file as an all-string Arrow table.
+    
+    Cached per file (path + content hash), so reruns hand st.dataframe the
+    ready table instead of re-reading and re-converting the workbook.
+    """
+    # Only the first rows are needed for a preview
+    df = pd.read_excel(
+        excel_path,
+        sheet_name=0,
+        header=None,
+        nrows=PREVIEW_MAX_ROWS,
+        engine='openpyxl'
+    )
+    df = df.fillna("").astype(str)
+    
+    # Fixed all-string schema - no per-column type inference
+    schema = pa.schema([(str(col), pa.string()) for col in df.columns])
+    return pa.Table.from_pandas(df.rename(columns=str), schema=schema, preserve_index=False)
+
 
 # =============================================================================
 # MAIN PAGE
@@ -55,9 +121,8 @@ def main():
             st.switch_page("app.py")
         return
     
-    # Get user from database for full object
-    with get_session() as session:
-        user = session.get(User, int(jwt_user['id']))
+    # Get user from database for full object (cached per login)
+    user = get_current_db_user(jwt_user)
     
     if not user:
         st.error("Хэрэглэгч олдсонгүй. Дахин нэвтэрнэ үү.")
@@ -80,38 +145,26 @@ def main():
 # MANAGER VIEW
 # =============================================================================
 
-def show_manager_view(user: User):
-    """Show pending approvals for managers - with Excel download."""
-    
-    st.header("👔 Менежерийн самбар - Хүлээгдэж байгаа")
-    st.info("📋 Доорх файлуудыг хянаж, Excel файлыг татаж үзээд батлах эсвэл буцаах боломжтой.")
-    
-    # =========================================================================
-    # SPECIALIST MANAGEMENT (Admin/Manager only)
-    # =========================================================================
+def get_current_specialists() -> list:
+    """Default specialists minus removed ones, followed by custom ones."""
+    removed = st.session_state.removed_specialists
+    return [s for s in DEFAULT_SPECIALISTS if s not in removed] + st.session_state.custom_specialists
+
+
+@fragment
+def show_specialists_manager():
+    """Specialist list editor; reruns on its own when its widgets change."""
     with st.expander("⚙️ Мэргэжилтнүүдийн жагсаалт засварлах"):
         st.caption("Төсөв оруулах үед сонгох мэргэжилтнүүдийг нэмэх эсвэл хасах")
         
         # Initialize session state
-        if 'removed_specialists' not in st.session_state:
-            st.session_state.removed_specialists = []
+        if not isinstance(st.session_state.get('removed_specialists'), set):
+            st.session_state.removed_specialists = set(st.session_state.get('removed_specialists', ()))
         if 'custom_specialists' not in st.session_state:
             st.session_state.custom_specialists = []
         
-        # Default specialists list
-        DEFAULT_SPECIALISTS = [
-            "Н. Энх-Өлзий",
-            "Д. Эгшиглэн",
-            "Ц. Содномцэрэн",
-            "М. Золзаяа",
-            "А. Жавхлан",
-            "М. Наранцацрал",
-            "Б. Наранцэцэг"
-        ]
-        
         # Get current specialists
-        all_default = [s for s in DEFAULT_SPECIALISTS if s not in st.session_state.removed_specialists]
-        all_specialists = all_default + st.session_state.custom_specialists
+        all_specialists = get_current_specialists()
         
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -140,8 +193,7 @@ def show_manager_view(user: User):
         st.write("**Одоогийн мэргэжилтнүүд:**")
         
         # Refresh all_specialists after potential changes
-        all_default = [s for s in DEFAULT_SPECIALISTS if s not in st.session_state.removed_specialists]
-        all_specialists = all_default + st.session_state.custom_specialists
+        all_specialists = get_current_specialists()
         
         # Show all specialists with remove option
         for i, name in enumerate(all_specialists):
@@ -152,165 +204,190 @@ def show_manager_view(user: User):
                 if st.button("❌ Хасах", key=f"remove_specialist_{i}"):
                     # Add to removed list or remove from custom list
                     if name in DEFAULT_SPECIALISTS:
-                        st.session_state.removed_specialists.append(name)
+                        st.session_state.removed_specialists.add(name)
                     elif name in st.session_state.custom_specialists:
                         st.session_state.custom_specialists.remove(name)
                     st.rerun()
         
         if not all_specialists:
             st.warning("Мэргэжилтэн байхгүй байна. Шинээр нэмнэ үү.")
+
+
+@fragment
+def show_pending_file(file: BudgetFile, user: User, excel_path: str, expanded: bool):
+    """Render one pending file; its widgets rerun only this file."""
+    budget_type_label = "Үндсэн төсөв" if file.budget_type.value == "primary" else "Нэмэлт төсөв"
+    total_amount_fmt = format_amount(file.total_amount)
+    planned_amount_fmt = format_amount(file.planned_amount)
     
-    st.divider()
-    
-    # Load pending files
-    pending_files = get_files_pending_approval(limit=50)
-    
-    if not pending_files:
-        st.success("✅ Батлах хүлээгдэж буй файл байхгүй байна!")
-        return
-    
-    st.write(f"**Таны хянаж үзэх {len(pending_files)} файл байна:**")
-    
-    # Display each pending file
-    for idx, file in enumerate(pending_files, 1):
-        budget_type_label = "Үндсэн төсөв" if file.budget_type.value == "primary" else "Нэмэлт төсөв"
+    with st.expander(f"📄 {file.filename} - {budget_type_label} (ID: {file.id})", expanded=expanded):
         
-        with st.expander(f"📄 {file.filename} - {budget_type_label} (ID: {file.id})", expanded=(idx == 1)):
-            
-            # File information
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                # Нийт бодит төсөв (actual budget)
-                if file.total_amount:
-                    st.metric("Нийт бодит төсөв", f"₮{float(file.total_amount):,.0f}")
-                else:
-                    st.metric("Нийт бодит төсөв", "N/A")
-            with col2:
-                # Нийт төсөв (planned budget)
-                if hasattr(file, 'planned_amount') and file.planned_amount:
-                    st.metric("Нийт төсөв", f"₮{float(file.planned_amount):,.0f}")
-                else:
-                    st.metric("Нийт төсөв", "N/A")
-            with col3:
-                # Show specialist name from budget file
-                specialist = getattr(file, 'specialist_name', None) or 'N/A'
-                st.write(f"**Төсөв оруулсан:** {specialist}")
-            with col4:
-                st.write(f"**Огноо:** {file.uploaded_at.strftime('%Y-%m-%d %H:%M')}")
+        # File information
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            # Нийт бодит төсөв (actual budget)
+            st.metric("Нийт бодит төсөв", total_amount_fmt)
+        with col2:
+            # Нийт төсөв (planned budget)
+            st.metric("Нийт төсөв", planned_amount_fmt)
+        with col3:
+            # Show specialist name from budget file
+            specialist = file.specialist_name or 'N/A'
+            st.write(f"**Төсөв оруулсан:** {specialist}")
+        with col4:
+            st.write(f"**Огноо:** {file.uploaded_at.strftime('%Y-%m-%d %H:%M')}")
+        
+        st.divider()
+        
+        # Download Excel file button
+        excel_file = open_file_or_none(excel_path)
+        if excel_file is not None:
+            # Hand the open file to Streamlit instead of buffering it here
+            with excel_file:
+                st.download_button(
+                    label="📥 Excel файл татах",
+                    data=excel_file,
+                    file_name=file.filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"download_{file.id}"
+                )
             
-            st.divider()
+            # Show PDF preview
+            st.subheader("📄 PDF Preview")
             
-            # Download Excel file button
-            excel_path = file.pdf_file_path  # We stored excel path here
-            if not excel_path:
-                excel_path = get_excel_file_path(file.id)
+            # Get the PDF preview generated above (or retry if it failed)
+            pdf_path = create_preview_pdf(excel_path, file.id)
             
-            if excel_path and os.path.exists(excel_path):
-                # Read Excel file as bytes for download
-                excel_bytes = read_excel_file_bytes(excel_path)
-                if excel_bytes:
-                    st.download_button(
-                        label="📥 Excel файл татах",
-                        data=excel_bytes,
-                        file_name=file.filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        key=f"download_{file.id}"
-                    )
-                    
-                    # Show PDF preview
-                    st.subheader("📄 PDF Preview")
+            # create_preview_pdf only returns paths that exist
+            if pdf_path:
+                # Read the PDF once; the same bytes feed the iframe and the download
+                pdf_bytes = read_pdf_bytes(pdf_path)
+                
+                if pdf_bytes:
+                    # Static URL when enabled, otherwise an embedded base64 data URI
+                    pdf_src = publish_preview_pdf(pdf_path, file.id)
+                    if pdf_src is None:
+                        pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
+                        pdf_src = f"data:application/pdf;base64,{pdf_base64}"
                     
-                    # Create or get existing PDF preview
-                    with st.spinner("PDF үүсгэж байна..."):
-                        pdf_path = create_preview_pdf(excel_path, file.id)
+                    # Display PDF in iframe
+                    pdf_display = f'''
+                    <iframe 
+                        src="{pdf_src}" 
+                        width="100%" 
+                        height="600px" 
+                        type="application/pdf"
+                        style="border: 1px solid #ddd; border-radius: 8px;">
+                    </iframe>
+                    '''
+                    st.markdown(pdf_display, unsafe_allow_html=True)
                     
-                    if pdf_path and os.path.exists(pdf_path):
-                        # Read PDF as base64
-                        pdf_base64 = read_pdf_as_base64(pdf_path)
-                        
-                        if pdf_base64:
-                            # Display PDF in iframe
-                            pdf_display = f'''
-                            <iframe 
-                                src="data:application/pdf;base64,{pdf_base64}" 
-                                width="100%" 
-                                height="600px" 
-                                type="application/pdf"
-                                style="border: 1px solid #ddd; border-radius: 8px;">
-                            </iframe>
-                            '''
-                            st.markdown(pdf_display, unsafe_allow_html=True)
-                            
-                            # Also provide PDF download button
-                            with open(pdf_path, "rb") as pdf_file:
-                                st.download_button(
-                                    label="📥 PDF татах",
-                                    data=pdf_file.read(),
-                                    file_name=f"{file.filename.rsplit('.', 1)[0]}.pdf",
-                                    mime="application/pdf",
-                                    key=f"download_pdf_{file.id}"
-                                )
-                        else:
-                            st.warning("PDF унших боломжгүй байна")
-                    else:
-                        st.warning("⚠️ PDF үүсгэхэд алдаа гарлаа. Excel preview харуулж байна.")
-                        # Fallback to Excel preview
-                        try:
-                            import pandas as pd
-                            xl = pd.ExcelFile(excel_path)
-                            target_sheet = xl.sheet_names[0]
-                            df = pd.read_excel(xl, sheet_name=target_sheet, header=None)
-                            for col in df.columns:
-                                df[col] = df[col].apply(lambda x: str(x) if pd.notna(x) else "")
-                            st.dataframe(df, height=400)
-                        except Exception as e:
-                            st.error(f"Preview харуулахад алдаа: {e}")
+                    # Also provide PDF download button
+                    st.download_button(
+                        label="📥 PDF татах",
+                        data=pdf_bytes,
+                        file_name=f"{file.filename.rsplit('.', 1)[0]}.pdf",
+                        mime="application/pdf",
+                        key=f"download_pdf_{file.id}"
+                    )
+                else:
+                    st.warning("PDF унших боломжгүй байна")
             else:
-                st.warning("⚠️ Excel файл олдсонгүй")
-            
-            st.divider()
-            
-            # Action buttons
-            st.subheader("⚡ Үйлдэл")
-            
-            col1, col2, col3 = st.columns([1, 1, 2])
-            
-            with col1:
-                if st.button("✅ Батлах", key=f"approve_{file.id}", type="primary"):
+                st.warning("⚠️ PDF үүсгэхэд алдаа гарлаа. Excel preview харуулж байна.")
+                # Fallback to Excel preview
+                try:
+                    st.dataframe(load_excel_preview(excel_path, file.file_hash), height=400)
+                except Exception as e:
+                    st.error(f"Preview харуулахад алдаа: {e}")
+        else:
+            st.warning("⚠️ Excel файл олдсонгүй")
+        
+        st.divider()
+        
+        # Action buttons
+        st.subheader("⚡ Үйлдэл")
+        
+        col1, col2, col3 = st.columns([1, 1, 2])
+        
+        with col1:
+            if st.button("✅ Батлах", key=f"approve_{file.id}", type="primary"):
+                success = update_budget_file_status(
+                    file.id,
+                    FileStatus.APPROVED_FOR_PRINT,
+                    reviewer_id=user.id
+                )
+                if success:
+                    st.success("✅ Файл батлагдлаа!")
+                    st.rerun()
+                else:
+                    st.error("Батлахад алдаа гарлаа")
+        
+        with col2:
+            reject_comment = st.text_input(
+                "Буцаах шалтгаан",
+                key=f"reject_comment_{file.id}",
+                placeholder="Шалтгаан бичнэ үү..."
+            )
+            if st.button("❌ Буцаах", key=f"reject_{file.id}"):
+                if not reject_comment:
+                    st.warning("Буцаах шалтгаан оруулна уу")
+                else:
+                    # Reject = set to REJECTED status
                     success = update_budget_file_status(
                         file.id,
-                        FileStatus.APPROVED_FOR_PRINT,
-                        reviewer_id=user.id
+                        FileStatus.REJECTED,
+                        reviewer_id=user.id,
+                        reviewer_comment=reject_comment
                     )
                     if success:
-                        st.success("✅ Файл батлагдлаа!")
+                        st.success("✅ Файл буцаагдлаа. Ажилтан засвар хийх боломжтой.")
                         st.rerun()
                     else:
-                        st.error("Батлахад алдаа гарлаа")
-            
-            with col2:
-                reject_comment = st.text_input(
-                    "Буцаах шалтгаан",
-                    key=f"reject_comment_{file.id}",
-                    placeholder="Шалтгаан бичнэ үү..."
-                )
-                if st.button("❌ Буцаах", key=f"reject_{file.id}"):
-                    if not reject_comment:
-                        st.warning("Буцаах шалтгаан оруулна уу")
-                    else:
-                        # Reject = set to REJECTED status
-                        success = update_budget_file_status(
-                            file.id,
-                            FileStatus.REJECTED,
-                            reviewer_id=user.id,
-                            reviewer_comment=reject_comment
-                        )
-                        if success:
-                            st.success("✅ Файл буцаагдлаа. Ажилтан засвар хийх боломжтой.")
-                            st.rerun()
-                        else:
-                            st.error("Буцаахад алдаа гарлаа")
+                        st.error("Буцаахад алдаа гарлаа")
+
+
+def show_manager_view(user: User):
+    """Show pending approvals for managers - with Excel download."""
+    
+    st.header("👔 Менежерийн самбар - Хүлээгдэж байгаа")
+    st.info("📋 Доорх файлуудыг хянаж, Excel файлыг татаж үзээд батлах эсвэл буцаах боломжтой.")
+    
+    # =========================================================================
+    # SPECIALIST MANAGEMENT (Admin/Manager only)
+    # =========================================================================
+    show_specialists_manager()
+    
+    st.divider()
+    
+    # Load pending files
+    pending_files = get_files_pending_approval(limit=50)
+    
+    if not pending_files:
+        st.success("✅ Батлах хүлээгдэж буй файл байхгүй байна!")
+        return
+    
+    st.write(f"**Таны хянаж үзэх {len(pending_files)} файл байна:**")
+    
+    # Resolve Excel paths once; older records may not have the path stored
+    excel_paths = {
+        file.id: file.pdf_file_path or get_excel_file_path(file.id)  # We stored excel path here
+        for file in pending_files
+    }
+    
+    # Generate all missing previews concurrently instead of one per expander
+    missing_previews = [
+        (excel_paths[file.id], file.id)
+        for file in pending_files
+        if excel_paths[file.id] and not preview_pdf_exists(file.id)
+    ]
+    if missing_previews:
+        with st.spinner(f"PDF үүсгэж байна ({len(missing_previews)})..."):
+            create_preview_pdfs(missing_previews)
+    
+    # Display each pending file
+    for idx, file in enumerate(pending_files, 1):
+        show_pending_file(file, user, excel_paths[file.id], expanded=(idx == 1))
 
 
 # =============================================================================
@@ -322,18 +399,11 @@ def show_planner_view(user: User):
     
     st.header("📋 Миний оруулсан төсвүүд")
     
-    # Get user's files
-    with get_session() as session:
-        from sqlmodel import select
-        statement = (
-            select(BudgetFile)
-            .where(BudgetFile.uploader_id == user.id)
-            .order_by(BudgetFile.uploaded_at.desc())
-        )
-        my_files = session.exec(statement).all()
+    # Get user's files in a single query (newest first), also partitioned by status
+    my_files, files_by_status = get_files_by_uploader_grouped(user.id)
     
     # Show rejected files prominently
-    rejected_files = [f for f in my_files if f.status == FileStatus.REJECTED]
+    rejected_files = files_by_status[FileStatus.REJECTED]
     if rejected_files:
         st.error(f"⚠️ {len(rejected_files)} файл буцаагдсан байна! Засвар хийж дахин илгээнэ үү.")
         
@@ -355,21 +425,8 @@ def show_planner_view(user: User):
     
     # Display files
     for file in my_files:
-        status_emoji = {
-            FileStatus.PENDING_APPROVAL: "🕐",
-            FileStatus.APPROVED_FOR_PRINT: "✅",
-            FileStatus.SIGNING: "📝",
-            FileStatus.FINALIZED: "🏁",
-            FileStatus.REJECTED: "❌"
-        }.get(file.status, "❓")
-        
-        status_text = {
-            FileStatus.PENDING_APPROVAL: "Хүлээгдэж байгаа",
-            FileStatus.APPROVED_FOR_PRINT: "Батлагдсан",
-            FileStatus.SIGNING: "Гарын үсэг зурж байна",
-            FileStatus.FINALIZED: "Дууссан",
-            FileStatus.REJECTED: "Буцаагдсан"
-        }.get(file.status, str(file.status))
+        status_emoji = STATUS_EMOJI.get(file.status, "❓")
+        status_text = STATUS_TEXT.get(file.status, str(file.status))
         
         with st.expander(f"{status_emoji} {file.filename} - {status_text}"):
             col1, col2, col3 = st.columns(3)
@@ -380,7 +437,7 @@ def show_planner_view(user: User):
             
             with col2:
                 if file.total_amount:
-                    st.write(f"**Нийт дүн:** ₮{float(file.total_amount):,.0f}")
+                    st.write(f"**Нийт дүн:** {format_amount(file.total_amount)}")
                 st.write(f"**Илгээсэн:** {file.uploaded_at.strftime('%Y-%m-%d %H:%M')}")
             
             with col3:
@@ -393,7 +450,4 @@ def show_planner_view(user: User):
 # RUN PAGE
 # =============================================================================
 
-if __name__ == "__main__":
-    main()
-else:
-    main()
+main()
@@ -10,9 +10,19 @@ Author: CPP Development Team
 
 import streamlit as st
 import pandas as pd
-import hashlib
+import numpy as np
+import io
+import os
 import re
-from datetime import datetime
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+# Optional: Rust-based Excel reader, much faster than openpyxl on big sheets
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None  # pip install python-calamine
 
 # Page configuration
 st.set_page_config(
@@ -22,16 +32,22 @@ st.set_page_config(
 )
 
 # Import our modules
-from config import BudgetType, FileStatus
+from config import BudgetType, FileStatus, SHOW_BALLOONS
 from database import get_session, User, BudgetFile
-from modules.jwt_auth import get_current_user_from_token
+from modules.jwt_auth import get_current_user_from_token, get_current_db_user
+from modules.streamlit_compat import fragment
 from modules.file_storage import (
     save_excel_file, 
-    create_preview_pdf, 
-    read_pdf_as_base64, 
-    get_excel_file_path
+    calculate_bytes_hash,
+    submit_preview_pdf,
+    read_pdf_as_base64,
+    publish_preview_pdf,
+    unpublish_preview_pdf
+)
+from modules.services import (
+    create_budget_file,
+    check_duplicate_file
 )
-from modules.services import create_budget_file, check_duplicate_file
 from sqlmodel import select
 
 
@@ -55,12 +71,13 @@ def get_specialist_list():
     # Check if custom specialists exist in session state
     if 'custom_specialists' not in st.session_state:
         st.session_state.custom_specialists = []
-    if 'removed_specialists' not in st.session_state:
-        st.session_state.removed_specialists = []
+    if not isinstance(st.session_state.get('removed_specialists'), set):
+        st.session_state.removed_specialists = set(st.session_state.get('removed_specialists', ()))
     
     # Combine default and custom, exclude removed
+    removed = st.session_state.removed_specialists
     all_specialists = DEFAULT_SPECIALISTS + st.session_state.custom_specialists
-    return [s for s in all_specialists if s not in st.session_state.removed_specialists]
+    return [s for s in all_specialists if s not in removed]
 
 
 # =============================================================================
@@ -68,21 +85,30 @@ def get_specialist_list():
 # =============================================================================
 
 def get_user_rejected_files(user_id: int):
-    """Get rejected files for a specific user."""
+    """
+    Get rejected files for a specific user.
+    
+    Only the columns shown in the rejected-files section are selected, so no
+    ORM objects or relationships are loaded.
+    """
     with get_session() as session:
         statement = (
-            select(BudgetFile)
+            select(
+                BudgetFile.id,
+                BudgetFile.filename,
+                BudgetFile.campaign_name,
+                BudgetFile.reviewer_comment,
+                BudgetFile.reviewed_at
+            )
             .where(BudgetFile.uploader_id == user_id)
             .where(BudgetFile.status == FileStatus.REJECTED)
             .order_by(BudgetFile.reviewed_at.desc())
         )
-        return list(session.exec(statement).all())
+        return session.exec(statement).all()
 
 
 def delete_rejected_file(file_id: int) -> bool:
     """Delete a rejected file from database and filesystem."""
-    import os
-    
     try:
         with get_session() as session:
             statement = select(BudgetFile).where(BudgetFile.id == file_id)
@@ -104,33 +130,52 @@ def delete_rejected_file(file_id: int) -> bool:
             
             # Also check for uploaded Excel files
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            excel_pattern = os.path.join(base_dir, 'assets', 'uploaded_files', f"budget_{file_id}_*.xlsx")
-            import glob
-            for excel_file in glob.glob(excel_pattern):
-                try:
-                    os.remove(excel_file)
-                except:
-                    pass
+            upload_dir = os.path.join(base_dir, 'assets', 'uploaded_files')
+            prefix = f"budget_{file_id}_"
+            try:
+                with os.scandir(upload_dir) as entries:
+                    for entry in entries:
+                        if entry.name.startswith(prefix) and entry.name.endswith('.xlsx'):
+                            try:
+                                os.unlink(entry.path)
+                            except OSError:
+                                pass
+            except OSError:
+                pass
+            
+            # Remove the preview published for static serving, if any
+            unpublish_preview_pdf(file_id)
             
             # Delete from database
             session.delete(file)
             session.commit()
-            
+        
+        get_primary_campaigns.clear()
         return True
     except Exception as e:
         print(f"Error deleting rejected file: {e}")
         return False
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_primary_campaigns(user_id: int = None):
     """Get list of PRIMARY budget campaigns for dropdown.
     
+    Only the columns used by the dropdown are selected (no ORM objects).
+    Cached per user for a minute; cleared when this page adds or deletes a file.
+    
     Args:
         user_id: If provided, filter by uploader. If None, return all.
     """
     with get_session() as session:
         statement = (
-            select(BudgetFile)
+            select(
+                BudgetFile.campaign_name,
+                BudgetFile.id,
+                BudgetFile.specialist_name,
+                BudgetFile.budget_code,
+                BudgetFile.brand
+            )
             .where(BudgetFile.budget_type == BudgetType.PRIMARY)
             .where(BudgetFile.campaign_name != None)
             .where(BudgetFile.campaign_name != "")
@@ -142,22 +187,166 @@ def get_primary_campaigns(user_id: int = None):
         
         statement = statement.order_by(BudgetFile.uploaded_at.desc())
         
-        files = session.exec(statement).all()
-        # Return unique campaign names with their file IDs
-        campaigns = {}
-        for f in files:
-            if f.campaign_name and f.campaign_name not in campaigns:
-                campaigns[f.campaign_name] = {
-                    'file_id': f.id,
-                    'specialist': f.specialist_name or '',
-                    'budget_code': f.budget_code or '',
-                    'brand': f.brand or ''
-                }
-        return campaigns
-
-def clean_currency_value(value_str: str) -> float:
+        rows = session.exec(statement).all()
+    
+    # Return unique campaign names with their file IDs (newest file wins)
+    campaigns = {}
+    for row in rows:
+        if row.campaign_name not in campaigns:
+            campaigns[row.campaign_name] = {
+                'file_id': row.id,
+                'specialist': row.specialist_name or '',
+                'budget_code': row.budget_code or '',
+                'brand': row.brand or ''
+            }
+    return campaigns
+
+
+# =============================================================================
+# EXCEL PARSING
+# =============================================================================
+
+# Rows scanned at the top (code, brand) and bottom (budget totals) of the sheet
+METADATA_SCAN_ROWS = 20
+TOTALS_SCAN_ROWS = 200
+
+# Sheets that are never the budget sheet (helper/reference sheets)
+SHEET_EXCLUDE_KEYWORDS = ('general', 'employee', 'target', 'all', 'validation', 'budget list', 'names')
+
+# Metadata labels in the top rows (matched lowercase)
+CODE_ROW_KEYWORDS = ('код', 'code', 'budget', 'төсөв')
+BRAND_LABELS = ('brand', 'брэнд')
+
+
+def find_target_sheet(sheet_names: list) -> str:
+    """
+    Pick the budget sheet - priority order matters!
+    
+    1. Sheet named exactly "TEMPLATE"
+    2. Sheet containing "гүйцэтгэл"
+    3. First sheet that is not a helper sheet (SHEET_EXCLUDE_KEYWORDS)
+    4. First sheet
+    
+    All candidates are found in a single pass over the names.
+    """
+    template_sheet = None
+    performance_sheet = None
+    fallback_sheet = None
+    
+    for sn in sheet_names:
+        name = sn.casefold()
+        if name == 'template':
+            template_sheet = sn
+            break  # Highest priority - nothing can beat it
+        if performance_sheet is None and 'гүйцэтгэл' in name:
+            performance_sheet = sn
+        elif fallback_sheet is None and not any(ex in name for ex in SHEET_EXCLUDE_KEYWORDS):
+            fallback_sheet = sn
+    
+    return template_sheet or performance_sheet or fallback_sheet or sheet_names[0]
+
+
+def collect_scan_rows(rows, first_row: int = 1) -> tuple:
+    """
+    Keep only the rows the extractor needs from an iterable of sheet rows.
+    
+    Args:
+        rows: Row value tuples/lists in sheet order
+        first_row: Excel row number (1-based) of the first row in rows
+    
+    Returns:
+        Tuple of (row_count, top_df, bottom_df) where row_count is the last
+        non-empty row number, top_df holds rows within the first
+        METADATA_SCAN_ROWS and bottom_df the last TOTALS_SCAN_ROWS non-empty
+        rows. Empty cells are None.
+    """
+    top_rows = []
+    bottom_rows = deque(maxlen=TOTALS_SCAN_ROWS)
+    row_count = 0
+    
+    for idx, row in enumerate(rows, first_row):
+        if idx <= METADATA_SCAN_ROWS:
+            top_rows.append(row)
+        if any(v is not None and v != '' for v in row):
+            bottom_rows.append(row)
+            row_count = idx  # Trailing empty rows are not counted
+    
+    def to_frame(kept_rows):
+        # calamine returns '' for empty cells, openpyxl returns None
+        return pd.DataFrame([[None if v == '' else v for v in row] for row in kept_rows])
+    
+    top_rows = top_rows[:max(0, row_count - first_row + 1)]
+    return row_count, to_frame(top_rows), to_frame(bottom_rows)
+
+
+def read_budget_sheet(file_obj) -> tuple:
+    """
+    Read only the parts of the budget sheet the extractor needs.
+    
+    Uses python-calamine when installed (the sheet is decoded in Rust).
+    Otherwise openpyxl in read-only mode reads the first
+    METADATA_SCAN_ROWS rows and the last TOTALS_SCAN_ROWS rows of the
+    sheet's used range; rows in between are skipped without being built.
+    If that tail holds no total label, the whole sheet is streamed instead.
+    
+    Returns:
+        Tuple of (sheet_names, target_sheet, row_count, top_df, bottom_df)
+        (see collect_scan_rows)
+    """
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_filelike(file_obj)
+        sheet_names = wb.sheet_names
+        target_sheet = find_target_sheet(sheet_names)
+        # skip_empty_area=False keeps row/column positions as in Excel
+        rows = wb.get_sheet_by_name(target_sheet).to_python(skip_empty_area=False)
+        return (sheet_names, target_sheet) + collect_scan_rows(rows)
+    
+    # Imported here - openpyxl is only needed without calamine
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        sheet_names = wb.sheetnames
+        target_sheet = find_target_sheet(sheet_names)
+        ws = wb[target_sheet]
+        
+        # Two small windows when the sheet declares its size (dimension tag)
+        max_row = ws.max_row
+        if max_row and max_row > METADATA_SCAN_ROWS + TOTALS_SCAN_ROWS:
+            tail_start = max_row - TOTALS_SCAN_ROWS + 1
+            _, top_df, _ = collect_scan_rows(
+                ws.iter_rows(max_row=METADATA_SCAN_ROWS, values_only=True)
+            )
+            row_count, _, bottom_df = collect_scan_rows(
+                ws.iter_rows(min_row=tail_start, max_row=max_row, values_only=True),
+                tail_start
+            )
+            if row_count and has_total_label(bottom_df):
+                return sheet_names, target_sheet, row_count, top_df, bottom_df
+            # No totals in the tail (stale or inflated declared size, e.g.
+            # stray cells far below the totals) - read everything
+        
+        rows = ws.iter_rows(values_only=True)
+        return (sheet_names, target_sheet) + collect_scan_rows(rows)
+    finally:
+        wb.close()
+
+
+# Budget total labels (searched bottom-up in the sheet tail)
+ACTUAL_BUDGET_LABEL = 'НИЙТ БОДИТ ТӨСӨВ'
+TOTAL_BUDGET_LABEL = 'НИЙТ ТӨСӨВ'
+MIN_BUDGET_AMOUNT = 1000000  # Totals are at least 1M
+
+# Everything except digits, dots, and minus (currency symbols, separators, text)
+CURRENCY_NOISE_PATTERN = re.compile(r'[^\d.\-]')
+
+# Rows with these words are sub-category totals, not the main "НИЙТ ТӨСӨВ"
+SUBTOTAL_WORDS = ('БОДИТ', 'ДОТООД', 'УРТ ХУГАЦААНЫ', 'ХИЙГДЭХ', 'СУВГИЙН', 'НӨЛӨӨЛӨГЧ', 'КОНТЕНТ')
+
+
+def parse_row_amounts(row_values: list) -> pd.Series:
     """
-    Clean and parse currency values from Excel.
+    Clean and parse currency values from Excel, a whole row at a time.
     
     Handles:
     - Commas: "10,000,000" -> 10000000
@@ -167,54 +356,178 @@ def clean_currency_value(value_str: str) -> float:
     - Trailing text: "16,434,532₮" -> 16434532
     
     Returns:
-        Float value or None if cannot parse
+        Series of floats (NaN where a cell cannot be parsed)
     """
-    if not value_str or value_str.lower() in ['nan', 'none', '', '-']:
-        return None
+    cleaned = pd.Series(row_values, dtype=str).str.replace(CURRENCY_NOISE_PATTERN, '', regex=True)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def find_row_amount(row_values, label_col: int):
+    """
+    Find the budget amount in a row that contains a total label.
     
-    # Remove all non-numeric characters except digits, dots, and minus
-    cleaned = re.sub(r'[^\d.\-]', '', str(value_str))
+    Looks at the cells after the label first, then falls back to any
+    cell in the row (the number might be in a column before the label).
+    """
+    amounts = parse_row_amounts(row_values)
+    is_budget = (amounts > MIN_BUDGET_AMOUNT).to_numpy()
     
-    if not cleaned or cleaned == '-':
-        return None
+    # Look for number in cells AFTER the label (same row)
+    after = is_budget[label_col + 1:]
+    if after.any():
+        return float(amounts.iat[label_col + 1 + after.argmax()])
     
-    try:
-        return float(cleaned)
-    except ValueError:
-        return None# =============================================================================
-# MAIN PAGE
-# =============================================================================
+    # If not found after label, check whole row
+    if is_budget.any():
+        return float(amounts.iat[is_budget.argmax()])
+    return None
 
-def main():
-    """Main upload page."""
+
+def has_total_label(bottom_df: pd.DataFrame) -> bool:
+    """Check whether any cell of the sheet tail holds a budget total label."""
+    if bottom_df.empty:
+        return False
+    grid = np.char.upper(bottom_df.fillna("").to_numpy(dtype=str))
+    return bool(
+        (np.char.find(grid, TOTAL_BUDGET_LABEL) >= 0).any()
+        or (np.char.find(grid, ACTUAL_BUDGET_LABEL) >= 0).any()
+    )
+
+
+def extract_budget_totals(bottom_df: pd.DataFrame) -> tuple:
+    """
+    Extract (total_budget, actual_budget) from the tail of the budget sheet.
     
-    # Check JWT authentication
-    jwt_user = get_current_user_from_token()
-    if not jwt_user:
-        st.title("📤 Төсөв оруулах")
-        st.warning("⚠️ Нэвтрэх шаардлагатай")
-        st.info("👈 Зүүн талын цэснээс **🏠 Home** хуудас руу очиж нэвтэрнэ үү.")
-        if st.button("🔐 Нэвтрэх хуудас руу очих"):
-            st.switch_page("app.py")
-        return
+    Labels are located with NumPy string ops over the whole cell grid at
+    once; only the matched rows (typically 1-2) are parsed for amounts.
+    """
+    total_budget = None      # Нийт төсөв (planned)
+    actual_budget = None     # Нийт бодит төсөв (actual)
     
-    # Get user from database for full object
-    with get_session() as session:
-        user = session.get(User, int(jwt_user['id']))
+    if bottom_df.empty:
+        return total_budget, actual_budget
     
-    if not user:
-        st.error("Хэрэглэгч олдсонгүй. Дахин нэвтэрнэ үү.")
-        st.stop()
+    grid = bottom_df.fillna("").to_numpy(dtype=str)
+    grid = np.char.upper(np.char.strip(grid))
     
-    # Page header
-    st.title("📤 Төсөв оруулах")
-    st.markdown(f"Тавтай морил, **{user.full_name or user.username}**")
-    st.info("📋 Энд оруулсан төсвүүд шууд менежерийн хянан баталгаажилтанд очно.")
+    actual_cells = np.char.find(grid, ACTUAL_BUDGET_LABEL) >= 0
+    total_cells = np.char.find(grid, TOTAL_BUDGET_LABEL) >= 0
+    
+    # Sub-category total rows never hold the main "НИЙТ ТӨСӨВ"
+    subtotal_rows = np.zeros(len(grid), dtype=bool)
+    for word in SUBTOTAL_WORDS:
+        subtotal_rows |= (np.char.find(grid, word) >= 0).any(axis=1)
+    
+    is_actual = actual_cells.any(axis=1)
+    is_total = total_cells.any(axis=1) & ~subtotal_rows
+    
+    # Search from BOTTOM to TOP - budget totals are usually at the end
+    for idx in np.flatnonzero(is_actual | is_total)[::-1]:
+        if actual_budget is None and is_actual[idx]:
+            actual_budget = find_row_amount(grid[idx], actual_cells[idx].argmax())
+        
+        if total_budget is None and is_total[idx]:
+            total_budget = find_row_amount(grid[idx], total_cells[idx].argmax())
+        
+        # Stop if we found both values
+        if actual_budget is not None and total_budget is not None:
+            break
+    
+    return total_budget, actual_budget
+
+
+def extract_sheet_metadata(top_df: pd.DataFrame) -> tuple:
+    """
+    Extract (budget_code, brand) from the first rows of the budget sheet.
+    """
+    budget_code = None
+    brand = None
+    
+    for idx in range(len(top_df)):
+        row = top_df.iloc[idx]
+        row_text = ' '.join([str(v) for v in row.values if pd.notna(v)]).lower()
+        
+        # Find budget code - look for patterns like "B2506E04" or "ТК-001"
+        if budget_code is None and any(kw in row_text for kw in CODE_ROW_KEYWORDS):
+            for val in row.values:
+                if pd.notna(val):
+                    val_str = str(val).strip()
+                    # Check if looks like a code (has numbers and letters or dashes)
+                    if any(c.isdigit() for c in val_str) and (any(c.isalpha() for c in val_str) or '-' in val_str):
+                        if len(val_str) >= 4 and len(val_str) <= 30:
+                            budget_code = val_str
+                            break
+        
+        # Find brand - look for "Brand:", "Брэнд:" etc
+        if brand is None:
+            for i, val in enumerate(row.values):
+                if pd.notna(val):
+                    val_str = str(val).lower()
+                    if any(label in val_str for label in BRAND_LABELS):
+                        # Next non-empty cell might be the brand name
+                        for j in range(i+1, len(row.values)):
+                            next_val = row.values[j]
+                            if pd.notna(next_val) and str(next_val).strip():
+                                brand = str(next_val).strip()
+                                break
+                        break
+    
+    return budget_code, brand
+
+
+def get_upload_hash(uploaded_file) -> str:
+    """
+    MD5 of an uploaded file, computed once per upload.
+    
+    Streamlit reruns the page on every widget change; the hash is kept in
+    session state under the upload's file_id so the bytes are not hashed
+    again until a different file is picked.
+    """
+    upload_id = getattr(uploaded_file, 'file_id', None)
+    cached = st.session_state.get('upload_hash')
+    if upload_id is not None and cached and cached[0] == upload_id:
+        return cached[1]
+    
+    file_hash = calculate_bytes_hash(uploaded_file.getvalue())
+    if upload_id is not None:
+        st.session_state.upload_hash = (upload_id, file_hash)
+    return file_hash
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def scan_budget_file(file_hash: str, _file_bytes: bytes) -> dict:
+    """
+    Parse the budget sheet and extract everything the submit handler needs.
     
-    # =========================================================================
-    # SHOW REJECTED FILES SECTION
-    # =========================================================================
-    rejected_files = get_user_rejected_files(user.id)
+    Keyed by the file hash (the raw bytes are excluded from Streamlit's
+    cache key). The sheet-name preview runs it as soon as a new file is picked,
+    so the rerun triggered by the submit button only reads the cache.
+    """
+    sheet_names, _, row_count, top_df, bottom_df = read_budget_sheet(io.BytesIO(_file_bytes))
+    
+    # Budget totals are searched bottom-up in the sheet tail
+    total_budget, actual_budget = extract_budget_totals(bottom_df)
+    # First 20 rows hold the metadata (code, brand)
+    budget_code, brand = extract_sheet_metadata(top_df)
+    
+    return {
+        "sheet_names": sheet_names,
+        "row_count": row_count,
+        "total_budget": total_budget,
+        "actual_budget": actual_budget,
+        "budget_code": budget_code,
+        "brand": brand,
+    }
+
+
+# =============================================================================
+# REJECTED FILES SECTION
+# =============================================================================
+
+@fragment
+def show_rejected_files(user_id: int):
+    """Show the user's rejected files with reasons and delete buttons."""
+    rejected_files = get_user_rejected_files(user_id)
     if rejected_files:
         st.error(f"⚠️ **{len(rejected_files)} төсөв буцаагдсан байна!** Засвар хийж дахин илгээнэ үү.")
         
@@ -232,13 +545,145 @@ def main():
                     if st.button("🗑️ Устгах", key=f"delete_rejected_{file.id}", type="secondary"):
                         if delete_rejected_file(file.id):
                             st.success("Файл устгагдлаа!")
-                            st.rerun()
+                            st.rerun()  # Full rerun - campaign list may have changed
                         else:
                             st.error("Устгахад алдаа гарлаа")
         
         st.markdown("---")
         st.markdown("👆 **Дээрх буцаагдсан файлуудаа устгаж, доорхи хэсгээр дахин зөв засаж хуулна уу.**")
         st.divider()
+
+
+# =============================================================================
+# UPLOAD SECTION
+# =============================================================================
+
+@fragment
+def show_upload_section():
+    """Show the Excel uploader and the picked file's info and duplicate status."""
+    st.markdown("#### 📁 Excel файл сонгох")
+    
+    uploaded_file = st.file_uploader(
+        "Excel файл сонгох*",
+        type=['xlsx', 'xls'],
+        help="Төсвийн төлөвлөлтийн Excel файлаа оруулна уу",
+        key="budget_excel_upload"
+    )
+    
+    # Show file info
+    if uploaded_file:
+        st.subheader("📋 Файлын мэдээлэл")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"**Файлын нэр:** {uploaded_file.name}")
+        with col2:
+            size_kb = uploaded_file.size / 1024
+            st.write(f"**Хэмжээ:** {size_kb:.1f} KB")
+        with col3:
+            st.write(f"**Төрөл:** Excel")
+        
+        # Duplicate check first (hash + index lookup) - only new files get parsed
+        file_bytes = uploaded_file.getvalue()
+        file_hash = get_upload_hash(uploaded_file)
+        existing_id = check_duplicate_file(file_hash)
+        if existing_id:
+            st.warning(f"⚠️ Энэ файл аль хэдийн хуулагдсан байна (File ID: {existing_id})")
+        else:
+            # Show sheet names
+            try:
+                sheet_names = scan_budget_file(file_hash, file_bytes)["sheet_names"]
+                st.write(f"**Sheet-үүд:** {', '.join(sheet_names)}")
+            except:
+                pass
+
+
+# =============================================================================
+# UPLOAD PREVIEW SECTION
+# =============================================================================
+
+# Seconds between checks of the background PDF conversion
+PREVIEW_POLL_SECONDS = 2
+
+
+@fragment(run_every=PREVIEW_POLL_SECONDS)
+def show_upload_preview(file_id: int):
+    """
+    Show the PDF preview of a just-uploaded file.
+    
+    The conversion runs on the preview pool (its Future is kept in session
+    state); this fragment re-runs on a timer and only reads the result once
+    the Future is done, so the page stays responsive while LibreOffice works.
+    """
+    state_key = f"pdf_{file_id}"
+    preview = st.session_state.get(state_key)
+    if preview is None:
+        return
+    
+    if isinstance(preview, Future):
+        if not preview.done():
+            st.info("⏳ PDF үүсгэж байна...")
+            return
+        
+        pdf_path = preview.result()
+        pdf_src = ""
+        if pdf_path:
+            # Static URL when enabled, otherwise an embedded base64 data URI
+            pdf_src = publish_preview_pdf(pdf_path, file_id)
+            if pdf_src is None:
+                pdf_base64 = read_pdf_as_base64(pdf_path)
+                pdf_src = f"data:application/pdf;base64,{pdf_base64}" if pdf_base64 else ""
+        
+        # Later timer runs re-render the same element without touching disk
+        preview = st.session_state[state_key] = pdf_src
+    
+    if preview:
+        # Display PDF in iframe
+        pdf_display = f'''
+        <iframe 
+            src="{preview}" 
+            width="100%" 
+            height="600px" 
+            type="application/pdf"
+            style="border: 1px solid #ddd; border-radius: 8px;">
+        </iframe>
+        '''
+        st.markdown(pdf_display, unsafe_allow_html=True)
+    else:
+        st.info("PDF preview үүсгэх боломжгүй байна")
+
+
+# =============================================================================
+# MAIN PAGE
+# =============================================================================
+
+def main():
+    """Main upload page."""
+    
+    # Check JWT authentication
+    jwt_user = get_current_user_from_token()
+    if not jwt_user:
+        st.title("📤 Төсөв оруулах")
+        st.warning("⚠️ Нэвтрэх шаардлагатай")
+        st.info("👈 Зүүн талын цэснээс **🏠 Home** хуудас руу очиж нэвтэрнэ үү.")
+        if st.button("🔐 Нэвтрэх хуудас руу очих"):
+            st.switch_page("app.py")
+        return
+    
+    # Get user from database for full object (cached per login)
+    user = get_current_db_user(jwt_user)
+    
+    if not user:
+        st.error("Хэрэглэгч олдсонгүй. Дахин нэвтэрнэ үү.")
+        st.stop()
+    
+    # Page header
+    st.title("📤 Төсөв оруулах")
+    st.markdown(f"Тавтай морил, **{user.full_name or user.username}**")
+    st.info("📋 Энд оруулсан төсвүүд шууд менежерийн хянан баталгаажилтанд очно.")
+    
+    # Rejected files (fragment - its widgets don't rerun the upload form)
+    show_rejected_files(user.id)
     
     st.divider()
     
@@ -302,36 +747,9 @@ def main():
     # FILE UPLOAD FIRST - Then extract campaign info from Excel
     # ==========================================================================
     
-    st.markdown("#### 📁 Excel файл сонгох")
-    
-    uploaded_file = st.file_uploader(
-        "Excel файл сонгох*",
-        type=['xlsx', 'xls'],
-        help="Төсвийн төлөвлөлтийн Excel файлаа оруулна уу",
-        key="budget_excel_upload"
-    )
-    
-    # Show file info
-    if uploaded_file:
-        st.subheader("📋 Файлын мэдээлэл")
-        
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.write(f"**Файлын нэр:** {uploaded_file.name}")
-        with col2:
-            size_kb = uploaded_file.size / 1024
-            st.write(f"**Хэмжээ:** {size_kb:.1f} KB")
-        with col3:
-            st.write(f"**Төрөл:** Excel")
-        
-        # Show sheet names
-        try:
-            uploaded_file.seek(0)
-            xl = pd.ExcelFile(uploaded_file)
-            st.write(f"**Sheet-үүд:** {', '.join(xl.sheet_names)}")
-            uploaded_file.seek(0)
-        except:
-            pass
+    # Uploader + file info (fragment - picking a file reruns only this part)
+    show_upload_section()
+    uploaded_file = st.session_state.get("budget_excel_upload")
     
     st.divider()
     
@@ -410,179 +828,38 @@ def save_file_and_notify(
     parent_file_id: int = None
 ):
     """Save the uploaded file and create database record."""
+    # Only needed once a file is submitted, not on every page visit
+    from modules.excel_handler import extract_metadata_from_filename
     
-    with st.spinner("Файл хадгалж байна..."):
-        try:
-            # Calculate file hash
-            uploaded_file.seek(0)
-            file_content = uploaded_file.read()
-            file_hash = hashlib.md5(file_content).hexdigest()
-            uploaded_file.seek(0)
+    try:
+        with st.spinner("Файл хадгалж байна..."):
+            # The upload is already in memory - take its bytes once and reuse them
+            file_bytes = uploaded_file.getvalue()
+            file_hash = get_upload_hash(uploaded_file)
             
             # Check for duplicates
-            existing = check_duplicate_file(file_hash)
-            if existing:
-                st.error(f"❌ Энэ файл аль хэдийн хуулагдсан байна (File ID: {existing.id})")
+            existing_id = check_duplicate_file(file_hash)
+            if existing_id:
+                st.error(f"❌ Энэ файл аль хэдийн хуулагдсан байна (File ID: {existing_id})")
                 st.warning("Засварласан хувилбарыг хуулахыг хүсвэл эхлээд файлд өөрчлөлт оруулна уу.")
                 return
             
-            # Get data from Excel
+            # Get data from Excel (single streaming pass over the target sheet)
             try:
-                uploaded_file.seek(0)
-                xl = pd.ExcelFile(uploaded_file)
-                
-                # =================================================================
-                # FIND TARGET SHEET - Priority order matters!
-                # =================================================================
-                target_sheet = None
-                
-                # 1. First, look for EXACT "TEMPLATE" sheet name
-                for sn in xl.sheet_names:
-                    if sn.upper() == 'TEMPLATE':
-                        target_sheet = sn
-                        break
-                
-                # 2. If not found, look for "гүйцэтгэл" sheet
-                if target_sheet is None:
-                    for sn in xl.sheet_names:
-                        if 'гүйцэтгэл' in sn.lower():
-                            target_sheet = sn
-                            break
-                
-                # 3. Fallback to first non-excluded sheet
-                if target_sheet is None:
-                    exclude_keywords = ['general', 'employee', 'target', 'all', 'validation', 'budget list', 'names']
-                    for sn in xl.sheet_names:
-                        sn_lower = sn.lower()
-                        if not any(ex in sn_lower for ex in exclude_keywords):
-                            target_sheet = sn
-                            break
-                
-                # 4. Last resort - first sheet
-                if target_sheet is None:
-                    target_sheet = xl.sheet_names[0]
-                
-                df = pd.read_excel(xl, sheet_name=target_sheet, header=None)
-                row_count = len(df)
-                
-                # Extract budget_code, brand, total_budget and actual_budget from Excel
-                budget_code = None
-                brand = None
-                total_budget = None      # Нийт төсөв (planned)
-                actual_budget = None     # Нийт бодит төсөв (actual)
-                
-                # =================================================================
-                # IMPROVED BUDGET EXTRACTION LOGIC
-                # =================================================================
-                # Search from BOTTOM to TOP - budget totals are usually at the end
-                for idx in range(len(df) - 1, -1, -1):
-                    row = df.iloc[idx]
-                    
-                    # Convert row to list of strings for easier processing
-                    row_values = [str(v).strip() if pd.notna(v) else "" for v in row.values]
-                    row_text = ' '.join(row_values).upper()
-                    
-                    # ===== FIND "НИЙТ БОДИТ ТӨСӨВ" =====
-                    # This should be the FINAL actual budget at the very bottom
-                    if actual_budget is None and 'НИЙТ БОДИТ ТӨСӨВ' in row_text:
-                        # Find the cell index containing "НИЙТ БОДИТ ТӨСӨВ"
-                        for i, val in enumerate(row_values):
-                            if 'НИЙТ БОДИТ ТӨСӨВ' in val.upper():
-                                # Look for number in cells AFTER this label (same row)
-                                for j in range(i + 1, len(row_values)):
-                                    num_str = row_values[j]
-                                    cleaned = clean_currency_value(num_str)
-                                    if cleaned and cleaned > 1000000:  # At least 1M
-                                        actual_budget = cleaned
-                                        break
-                                break
-                        # If not found in same row, check next row (label might be in separate row)
-                        if actual_budget is None:
-                            for val in row_values:
-                                cleaned = clean_currency_value(val)
-                                if cleaned and cleaned > 1000000:
-                                    actual_budget = cleaned
-                                    break
-                    
-                    # ===== FIND "НИЙТ ТӨСӨВ" (but NOT "БОДИТ" or subtotals) =====
-                    # Must be the main total, not sub-category totals
-                    if total_budget is None:
-                        # Check if this row has EXACTLY "НИЙТ ТӨСӨВ" (standalone total)
-                        is_main_total = False
-                        exclude_words = ['БОДИТ', 'ДОТООД', 'УРТ ХУГАЦААНЫ', 'ХИЙГДЭХ', 'СУВГИЙН', 'НӨЛӨӨЛӨГЧ', 'КОНТЕНТ']
-                        
-                        if 'НИЙТ ТӨСӨВ' in row_text:
-                            # Check it's not a subtotal
-                            if not any(ex in row_text for ex in exclude_words):
-                                is_main_total = True
-                        
-                        if is_main_total:
-                            for i, val in enumerate(row_values):
-                                if 'НИЙТ ТӨСӨВ' in val.upper() and 'БОДИТ' not in val.upper():
-                                    # Look for number AFTER this label
-                                    for j in range(i + 1, len(row_values)):
-                                        cleaned = clean_currency_value(row_values[j])
-                                        if cleaned and cleaned > 1000000:
-                                            total_budget = cleaned
-                                            break
-                                    break
-                            # If not found after label, check whole row
-                            if total_budget is None:
-                                for val in row_values:
-                                    cleaned = clean_currency_value(val)
-                                    if cleaned and cleaned > 1000000:
-                                        total_budget = cleaned
-                                        break
-                    
-                    # Stop if we found both values
-                    if actual_budget is not None and total_budget is not None:
-                        break
-                
-                # Search first 20 rows for metadata (code, brand)
-                for idx in range(min(20, len(df))):
-                    row = df.iloc[idx]
-                    row_text = ' '.join([str(v) for v in row.values if pd.notna(v)])
-                    
-                    # Find budget code - look for patterns like "B2506E04" or "ТК-001"
-                    if budget_code is None:
-                        for val in row.values:
-                            if pd.notna(val):
-                                val_str = str(val).strip()
-                                # Check if looks like a code (has numbers and letters or dashes)
-                                if any(c.isdigit() for c in val_str) and (any(c.isalpha() for c in val_str) or '-' in val_str):
-                                    if len(val_str) >= 4 and len(val_str) <= 30:
-                                        if 'код' in row_text.lower() or 'code' in row_text.lower() or 'budget' in row_text.lower() or 'төсөв' in row_text.lower():
-                                            budget_code = val_str
-                                            break
-                    
-                    # Find brand - look for "Brand:", "Брэнд:" etc
-                    if brand is None:
-                        for i, val in enumerate(row.values):
-                            if pd.notna(val):
-                                val_str = str(val).lower()
-                                if 'brand' in val_str or 'брэнд' in val_str:
-                                    # Next non-empty cell might be the brand name
-                                    for j in range(i+1, len(row.values)):
-                                        next_val = row.values[j]
-                                        if pd.notna(next_val) and str(next_val).strip():
-                                            brand = str(next_val).strip()
-                                            break
-                                    break
+                scan = scan_budget_file(file_hash, file_bytes)
+                row_count = scan["row_count"]
+                total_budget = scan["total_budget"]
+                actual_budget = scan["actual_budget"]
+                budget_code = scan["budget_code"]
+                brand = scan["brand"]
                 
-                # If budget_code not found, try to find from filename
+                # If budget_code/brand not found, try from filename
+                # like "B2506E04_TOKI MOVIE.xlsx"
+                filename_code, filename_brand = extract_metadata_from_filename(uploaded_file.name)
                 if budget_code is None:
-                    # Try to extract code from filename like "B2506E04_TOKI MOVIE.xlsx"
-                    import re
-                    match = re.search(r'([A-Z]\d{4}[A-Z]\d{2}|[A-Za-z0-9]+-\d+-\d+|[A-Za-z]{2,}-\d+)', uploaded_file.name)
-                    if match:
-                        budget_code = match.group(1)
-                
-                # If brand not found, try from filename
+                    budget_code = filename_code
                 if brand is None:
-                    # Extract brand from filename (first part before underscore)
-                    name_parts = uploaded_file.name.replace('.xlsx', '').replace('.xls', '').split('_')
-                    if len(name_parts) > 1:
-                        brand = name_parts[0]
+                    brand = filename_brand
                         
             except Exception as e:
                 row_count = 0
@@ -591,120 +868,112 @@ def save_file_and_notify(
                 budget_code = None
                 brand = None
             
-            # Create database record first
-            budget_file = create_budget_file(
-                filename=uploaded_file.name,
-                budget_type=budget_type,
-                uploader_id=user.id,
-                row_count=row_count,
-                total_amount=actual_budget,       # Нийт бодит төсөв
-                planned_amount=total_budget,      # Нийт төсөв
-                file_hash=file_hash,
-                budget_code=budget_code,
-                brand=brand,
-                campaign_name=campaign_name,
-                specialist_name=specialist_name,
-                parent_file_id=parent_file_id
-            )
-            
-            # Save Excel file to disk
-            uploaded_file.seek(0)
-            success, file_path, message = save_excel_file(
-                uploaded_file,
-                budget_file.id,
-                user.username
-            )
-            
-            if not success:
-                st.error(f"❌ Файл хадгалахад алдаа: {message}")
-                return
+            def store_excel(file_id: int) -> str:
+                """Save the Excel file to disk (exact copy) under its new ID."""
+                success, file_path, message = save_excel_file(
+                    uploaded_file,
+                    file_id,
+                    user.username
+                )
+                if not success:
+                    raise OSError(message)
+                return file_path
             
-            # Update file path in database
+            # Create database record together with the saved Excel path;
+            # the session covers only the insert and its duplicate re-check
             with get_session() as session:
-                db_file = session.get(BudgetFile, budget_file.id)
-                if db_file:
-                    db_file.pdf_file_path = file_path  # Using this field for excel path
-                    session.commit()
+                try:
+                    budget_file = create_budget_file(
+                        filename=uploaded_file.name,
+                        budget_type=budget_type,
+                        uploader_id=user.id,
+                        row_count=row_count,
+                        total_amount=actual_budget,       # Нийт бодит төсөв
+                        planned_amount=total_budget,      # Нийт төсөв
+                        file_hash=file_hash,
+                        budget_code=budget_code,
+                        brand=brand,
+                        campaign_name=campaign_name,
+                        specialist_name=specialist_name,
+                        parent_file_id=parent_file_id,
+                        unique_hash=True,
+                        store_file=store_excel,
+                        session=session
+                    )
+                except OSError as e:
+                    st.error(f"❌ Файл хадгалахад алдаа: {e}")
+                    return
+                
+                # Same file was uploaded while this one was being processed
+                if budget_file is None:
+                    existing_id = check_duplicate_file(file_hash, session=session)
+                    st.error(f"❌ Энэ файл аль хэдийн хуулагдсан байна (File ID: {existing_id})")
+                    return
             
-            # Show success
+        file_path = budget_file.pdf_file_path
+        get_primary_campaigns.clear()  # New campaign may be selectable now
+        
+        # Start the PDF preview now; show_upload_preview picks up the result
+        st.session_state[f"pdf_{budget_file.id}"] = submit_preview_pdf(file_path, budget_file.id)
+        
+        # Show success
+        if SHOW_BALLOONS:
             st.balloons()
-            st.success("🎉 **Файл амжилттай хуулагдлаа!**")
-            
-            # Show campaign info
-            if campaign_name:
-                budget_type_label = "Үндсэн төсөв" if budget_type == BudgetType.PRIMARY.value else "Нэмэлт төсөв"
-                st.info(f"""
-                **📋 Кампанит ажлын мэдээлэл:**
-                - 🏷️ Төрөл: {budget_type_label}
-                - 📌 Кампанит ажил: {campaign_name}
-                - 👤 Мэргэжилтэн: {specialist_name or 'N/A'}
-                {f"- 🔗 Холбосон үндсэн төсөв: #{parent_file_id}" if parent_file_id else ""}
-                """)
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                # Нийт бодит төсөв
-                if actual_budget:
-                    st.metric("Нийт бодит төсөв", f"₮{actual_budget:,.0f}")
-                else:
-                    st.metric("Нийт бодит төсөв", "N/A")
-            with col2:
-                # Нийт төсөв
-                if total_budget:
-                    st.metric("Нийт төсөв", f"₮{total_budget:,.0f}")
-                else:
-                    st.metric("Нийт төсөв", "N/A")
-            with col3:
-                st.metric("File ID", budget_file.id)
-            
-            # Generate and show PDF preview
-            st.divider()
-            st.subheader("📄 Файлын PDF Preview")
-            
-            with st.spinner("PDF үүсгэж байна..."):
-                pdf_path = create_preview_pdf(file_path, budget_file.id)
-            
-            if pdf_path:
-                pdf_base64 = read_pdf_as_base64(pdf_path)
-                if pdf_base64:
-                    # Display PDF in iframe
-                    pdf_display = f'''
-                    <iframe 
-                        src="data:application/pdf;base64,{pdf_base64}" 
-                        width="100%" 
-                        height="600px" 
-                        type="application/pdf"
-                        style="border: 1px solid #ddd; border-radius: 8px;">
-                    </iframe>
-                    '''
-                    st.markdown(pdf_display, unsafe_allow_html=True)
-                else:
-                    st.info("PDF preview ачааллах боломжгүй байна")
+        success_lines = ["🎉 **Файл амжилттай хуулагдлаа!**"]
+        
+        # Campaign info goes in the same message (one element, not two)
+        if campaign_name:
+            budget_type_label = "Үндсэн төсөв" if budget_type == BudgetType.PRIMARY.value else "Нэмэлт төсөв"
+            success_lines += [
+                "",
+                "**📋 Кампанит ажлын мэдээлэл:**",
+                f"- 🏷️ Төрөл: {budget_type_label}",
+                f"- 📌 Кампанит ажил: {campaign_name}",
+                f"- 👤 Мэргэжилтэн: {specialist_name or 'N/A'}",
+            ]
+            if parent_file_id:
+                success_lines.append(f"- 🔗 Холбосон үндсэн төсөв: #{parent_file_id}")
+        st.success("\n".join(success_lines))
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            # Нийт бодит төсөв
+            if actual_budget:
+                st.metric("Нийт бодит төсөв", f"₮{actual_budget:,.0f}")
             else:
-                st.info("PDF preview үүсгэх боломжгүй байна")
-            
-            st.divider()
-            st.info(f"""
-            **Дараагийн алхмууд:**
-            1. ✅ Таны файл одоо БАТЛАХ ХҮЛЭЭЛТ төлөвтэй байна
-            2. 👔 Менежер таны Excel файлыг шууд хянаж батална
-            3. 📋 Менежер файлыг татаж, Excel дээр шууд үзэх боломжтой
-            """)
-            
-            st.page_link("pages/1_🔄_Workflow.py", label="➡️ Ажлын урсгал руу очих", icon="🔄")
-            
-        except Exception as e:
-            st.error(f"❌ Алдаа гарлаа: {str(e)}")
-            import traceback
-            with st.expander("Алдааны дэлгэрэнгүй"):
-                st.code(traceback.format_exc())
+                st.metric("Нийт бодит төсөв", "N/A")
+        with col2:
+            # Нийт төсөв
+            if total_budget:
+                st.metric("Нийт төсөв", f"₮{total_budget:,.0f}")
+            else:
+                st.metric("Нийт төсөв", "N/A")
+        with col3:
+            st.metric("File ID", budget_file.id)
+        
+        # PDF preview (fragment - polls the background conversion)
+        st.divider()
+        st.subheader("📄 Файлын PDF Preview")
+        show_upload_preview(budget_file.id)
+        
+        st.divider()
+        st.info(f"""
+        **Дараагийн алхмууд:**
+        1. ✅ Таны файл одоо БАТЛАХ ХҮЛЭЭЛТ төлөвтэй байна
+        2. 👔 Менежер таны Excel файлыг шууд хянаж батална
+        3. 📋 Менежер файлыг татаж, Excel дээр шууд үзэх боломжтой
+        """)
+        
+        st.page_link("pages/1_🔄_Workflow.py", label="➡️ Ажлын урсгал руу очих", icon="🔄")
+        
+    except Exception as e:
+        st.error(f"❌ Алдаа гарлаа: {str(e)}")
+        with st.expander("Алдааны дэлгэрэнгүй"):
+            st.code(traceback.format_exc())
 
 
 # =============================================================================
 # RUN PAGE
 # =============================================================================
 
-if __name__ == "__main__":
-    main()
-else:
-    main()
+main()
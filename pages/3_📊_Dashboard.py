@@ -26,7 +26,7 @@ st.set_page_config(
 )
 
 # Import our modules
-from config import FileStatus
+from config import BudgetType, FileStatus
 from database import get_session, BudgetFile, User
 from modules.jwt_auth import get_current_user_from_token
 from modules.file_storage import read_excel_file, get_excel_file_path
@@ -40,11 +40,37 @@ from modules.analytics import (
     get_status_distribution
 )
 from modules.report_generator import export_cpp_report
-from sqlmodel import select
+from sqlmodel import select, func
 
 # Mongolia timezone (UTC+8)
 MONGOLIA_TZ = timezone(timedelta(hours=8))
 
+# Rows per page in the Files tab table
+FILES_PAGE_SIZE = 20
+
+# Files tab sort choices -> ORDER BY (id breaks ties so pages stay stable)
+FILES_SORT_OPTIONS = {
+    "Огноо (шинэ нь эхэнд)": (BudgetFile.uploaded_at.desc(), BudgetFile.id.desc()),
+    "Огноо (хуучин нь эхэнд)": (BudgetFile.uploaded_at.asc(), BudgetFile.id.asc()),
+    "Төсвийн код": (BudgetFile.budget_code.asc(), BudgetFile.id.asc()),
+    "Нийт төсөв (их нь эхэнд)": (BudgetFile.planned_amount.desc(), BudgetFile.id.desc()),
+    "Төлөв": (BudgetFile.status.asc(), BudgetFile.id.desc()),
+}
+
+# Files tab status labels (metrics / table), looked up by enum member
+FILE_STATUS_METRIC_LABELS = {
+    FileStatus.PENDING_APPROVAL: "Хүлээгдэж буй",
+    FileStatus.APPROVED_FOR_PRINT: "Батлагдсан",
+    FileStatus.REJECTED: "Буцаагдсан",
+    FileStatus.FINALIZED: "Дууссан"
+}
+FILE_STATUS_LABELS = {
+    FileStatus.PENDING_APPROVAL: "🕐 Хүлээгдэж буй",
+    FileStatus.APPROVED_FOR_PRINT: "✅ Батлагдсан",
+    FileStatus.REJECTED: "❌ Буцаагдсан",
+    FileStatus.FINALIZED: "🏁 Дууссан"
+}
+
 
 def format_datetime(dt):
     """Format datetime to Mongolia timezone."""
@@ -81,92 +107,100 @@ def generate_excel_pdf(file_data: dict, excel_path: str = None) -> bytes:
 # BULK EXCEL EXPORT FUNCTION
 # =============================================================================
 
-def generate_bulk_excel_export(all_files_data: list, all_channel_totals: dict, all_channel_details: dict, grand_totals: dict) -> bytes:
-    """
-    Generate a comprehensive Excel file with all budget data.
-    
-    Creates an Excel workbook with multiple sheets:
-    1. Summary - All campaigns overview with key metrics
-    2. Channels - Aggregated budget by channel type
-    3. Details - All line items across all files
-    4. Campaigns - Campaign headers and metadata
-    
-    Args:
-        all_files_data: List of dicts with file, header, sections, totals
-        all_channel_totals: Dict of channel name -> total budget
-        all_channel_details: Dict of channel name -> list of file data
-        grand_totals: Dict with total_budget and actual_budget
-    
-    Returns:
-        Excel file as bytes
-    """
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-    from openpyxl.utils.dataframe import dataframe_to_rows
-    
-    output = io.BytesIO()
-    wb = Workbook()
-    
-    # Styles
-    header_font = Font(bold=True, size=12, color="FFFFFF")
-    header_fill = PatternFill(start_color="2E75B6", end_color="2E75B6", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    subheader_fill = PatternFill(start_color="BDD7EE", end_color="BDD7EE", fill_type="solid")
-    subheader_font = Font(bold=True, size=11)
-    
-    number_format = '#,##0'
-    currency_format = '₮#,##0'
-    
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
+def _bulk_export_formats(wb) -> dict:
+    """Cell formats for the bulk export, added to the workbook once."""
+    currency = '₮#,##0'
+    return {
+        'title': wb.add_format({'bold': True, 'font_size': 14, 'align': 'center'}),
+        'summary_title': wb.add_format({'bold': True, 'font_size': 16, 'align': 'center'}),
+        'header': wb.add_format({
+            'bold': True, 'font_size': 12, 'font_color': '#FFFFFF', 'bg_color': '#2E75B6',
+            'align': 'center', 'valign': 'vcenter', 'text_wrap': True, 'border': 1
+        }),
+        'subheader': wb.add_format({'bold': True, 'font_size': 11, 'bg_color': '#BDD7EE', 'border': 1}),
+        'subheader_currency': wb.add_format({
+            'bold': True, 'font_size': 11, 'bg_color': '#BDD7EE', 'border': 1, 'num_format': currency
+        }),
+        'bold': wb.add_format({'bold': True}),
+        'amount': wb.add_format({'num_format': currency}),
+        'bordered': wb.add_format({'border': 1}),
+        'bold_bordered': wb.add_format({'bold': True, 'border': 1}),
+        'currency': wb.add_format({'border': 1, 'num_format': currency}),
+        'bold_currency': wb.add_format({'bold': True, 'border': 1, 'num_format': currency}),
+    }
+
+
+def _add_bulk_sheet(wb, formats: dict, name: str, title: str, widths: list, title_format: str = 'title'):
+    """Add a worksheet with its column widths and merged title row."""
+    ws = wb.add_worksheet(name)
+    for col, width in enumerate(widths):
+        ws.set_column(col, col, width)
+    ws.merge_range(0, 0, 0, len(widths) - 1, title, formats[title_format])
+    return ws
+
+
+def _bulk_row_formats(formats: dict, width: int, currency_columns: tuple = ()) -> list:
+    """Per-column formats for a sheet's bordered data rows (1-based currency columns)."""
+    return [
+        formats['currency'] if col_idx in currency_columns else formats['bordered']
+        for col_idx in range(1, width + 1)
+    ]
+
+
+def _write_bulk_row(ws, row: int, row_data: list, row_formats: list):
+    write = ws.write  # looked up once per row, not once per cell
+    for col, value in enumerate(row_data):
+        write(row, col, value, row_formats[col])
+
+
+def _iter_section_rows(section: dict):
+    """Yield (subsection name, row) for a section's line items; "-" for direct rows."""
+    if section['subsections']:
+        for sub in section['subsections']:
+            for r in sub['rows']:
+                if isinstance(r, dict):
+                    yield sub['name'], r
+    else:
+        for r in section['rows']:
+            if isinstance(r, dict):
+                yield "-", r
+
+
+def _line_item_values(r: dict) -> tuple:
+    """A line item's (type, task, vendor, owner, freq, unit_price, total, note) with defaults."""
+    get = r.get
+    return (
+        get('type', ''), get('task', ''), get('vendor', ''), get('owner', ''),
+        get('freq', ''), get('unit_price', ''), get('total') or 0, get('note', '')
     )
-    
-    # =========================================================================
-    # SHEET 1: Summary - All campaigns overview
-    # =========================================================================
-    ws_summary = wb.active
-    ws_summary.title = "Summary"
-    
-    # Title
-    ws_summary.merge_cells('A1:H1')
-    ws_summary['A1'] = "📊 ТӨСВИЙН НЭГТГЭЛ - БҮРЭН ТАЙЛАН"
-    ws_summary['A1'].font = Font(bold=True, size=16)
-    ws_summary['A1'].alignment = Alignment(horizontal="center")
+
+
+def write_summary_sheet(wb, formats: dict, all_files_data: list, grand_totals: dict):
+    """Summary sheet - all campaigns overview."""
+    ws = _add_bulk_sheet(wb, formats, "Summary", "📊 ТӨСВИЙН НЭГТГЭЛ - БҮРЭН ТАЙЛАН",
+                         [5, 35, 25, 15, 15, 20, 18, 18], title_format='summary_title')
     
     # Grand totals
-    ws_summary['A3'] = "Нийт файлын тоо:"
-    ws_summary['B3'] = len(all_files_data)
-    ws_summary['C3'] = "Нийт төсөв:"
-    ws_summary['D3'] = grand_totals.get('total_budget', 0)
-    ws_summary['D3'].number_format = currency_format
-    ws_summary['E3'] = "Нийт бодит:"
-    ws_summary['F3'] = grand_totals.get('actual_budget', 0)
-    ws_summary['F3'].number_format = currency_format
-    
-    for col in ['A3', 'C3', 'E3']:
-        ws_summary[col].font = Font(bold=True)
+    ws.write(2, 0, "Нийт файлын тоо:", formats['bold'])
+    ws.write(2, 1, len(all_files_data))
+    ws.write(2, 2, "Нийт төсөв:", formats['bold'])
+    ws.write(2, 3, grand_totals.get('total_budget', 0), formats['amount'])
+    ws.write(2, 4, "Нийт бодит:", formats['bold'])
+    ws.write(2, 5, grand_totals.get('actual_budget', 0), formats['amount'])
     
     # Headers
-    summary_headers = ["№", "Кампанит ажил", "Төсвийн код", "Компани", "Огноо", "Хугацаа", "Нийт төсөв", "Бодит төсөв"]
-    for col_idx, header in enumerate(summary_headers, 1):
-        cell = ws_summary.cell(row=5, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
+    ws.write_row(4, 0, ["№", "Кампанит ажил", "Төсвийн код", "Компани", "Огноо", "Хугацаа", "Нийт төсөв", "Бодит төсөв"],
+                 formats['header'])
     
     # Data rows
-    for row_idx, fd in enumerate(all_files_data, 6):
+    row_formats = _bulk_row_formats(formats, 8, currency_columns=(7, 8))  # Budget columns
+    for row_idx, fd in enumerate(all_files_data, 5):
         header = fd['header']
         totals = fd['totals']
         f = fd['file']
         
-        row_data = [
-            row_idx - 5,
+        _write_bulk_row(ws, row_idx, [
+            row_idx - 4,
             header['campaign_name'] or "-",
             header['budget_code'] or f.budget_code or "-",
             header['company'] or "-",
@@ -174,193 +208,69 @@ def generate_bulk_excel_export(all_files_data: list, all_channel_totals: dict, a
             header['period'] or "-",
             totals['total_budget'],
             totals['actual_budget']
-        ]
-        
-        for col_idx, value in enumerate(row_data, 1):
-            cell = ws_summary.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
-            if col_idx in [7, 8]:  # Budget columns
-                cell.number_format = currency_format
-    
-    # Adjust column widths
-    ws_summary.column_dimensions['A'].width = 5
-    ws_summary.column_dimensions['B'].width = 35
-    ws_summary.column_dimensions['C'].width = 25
-    ws_summary.column_dimensions['D'].width = 15
-    ws_summary.column_dimensions['E'].width = 15
-    ws_summary.column_dimensions['F'].width = 20
-    ws_summary.column_dimensions['G'].width = 18
-    ws_summary.column_dimensions['H'].width = 18
-    
-    # =========================================================================
-    # SHEET 2: Channels - Budget by channel type
-    # =========================================================================
-    ws_channels = wb.create_sheet("Channels")
-    
-    ws_channels.merge_cells('A1:D1')
-    ws_channels['A1'] = "📊 СУВГААР НЭГТГЭСЭН ТӨСӨВ"
-    ws_channels['A1'].font = Font(bold=True, size=14)
-    ws_channels['A1'].alignment = Alignment(horizontal="center")
+        ], row_formats)
+
+
+def write_channels_sheet(wb, formats: dict, all_files_data: list, all_channel_totals: dict, all_channel_details: dict):
+    """Channels sheet - budget by channel type."""
+    ws = _add_bulk_sheet(wb, formats, "Channels", "📊 СУВГААР НЭГТГЭСЭН ТӨСӨВ", [5, 40, 20, 15])
     
-    channel_headers = ["№", "Суваг", "Нийт төсөв", "Файлын тоо"]
-    for col_idx, header in enumerate(channel_headers, 1):
-        cell = ws_channels.cell(row=3, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
+    ws.write_row(2, 0, ["№", "Суваг", "Нийт төсөв", "Файлын тоо"], formats['header'])
     
+    row_formats = _bulk_row_formats(formats, 4, currency_columns=(3,))
     sorted_channels = sorted(all_channel_totals.items(), key=lambda x: x[1], reverse=True)
-    for row_idx, (ch_name, ch_total) in enumerate(sorted_channels, 4):
+    for row_idx, (ch_name, ch_total) in enumerate(sorted_channels, 3):
         num_files = len(all_channel_details.get(ch_name, []))
-        row_data = [row_idx - 3, ch_name, ch_total, num_files]
-        
-        for col_idx, value in enumerate(row_data, 1):
-            cell = ws_channels.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
-            if col_idx == 3:
-                cell.number_format = currency_format
+        _write_bulk_row(ws, row_idx, [row_idx - 2, ch_name, ch_total, num_files], row_formats)
     
     # Total row
-    total_row = len(sorted_channels) + 4
-    ws_channels.cell(row=total_row, column=1, value="").border = thin_border
-    ws_channels.cell(row=total_row, column=2, value="НИЙТ").font = Font(bold=True)
-    ws_channels.cell(row=total_row, column=2, value="НИЙТ").border = thin_border
-    total_cell = ws_channels.cell(row=total_row, column=3, value=sum(all_channel_totals.values()))
-    total_cell.number_format = currency_format
-    total_cell.font = Font(bold=True)
-    total_cell.border = thin_border
-    ws_channels.cell(row=total_row, column=4, value=len(all_files_data)).border = thin_border
-    
-    ws_channels.column_dimensions['A'].width = 5
-    ws_channels.column_dimensions['B'].width = 40
-    ws_channels.column_dimensions['C'].width = 20
-    ws_channels.column_dimensions['D'].width = 15
-    
-    # =========================================================================
-    # SHEET 3: Details - All line items with full details
-    # =========================================================================
-    ws_details = wb.create_sheet("Details")
-    
-    ws_details.merge_cells('A1:L1')
-    ws_details['A1'] = "📋 БҮРЭН ЗАДАРГАА - БҮХ МӨРҮҮД"
-    ws_details['A1'].font = Font(bold=True, size=14)
-    ws_details['A1'].alignment = Alignment(horizontal="center")
+    _write_bulk_row(ws, len(sorted_channels) + 3, [
+        "", "НИЙТ", sum(all_channel_totals.values()), len(all_files_data)
+    ], [formats['bordered'], formats['bold_bordered'], formats['bold_currency'], formats['bordered']])
+
+
+def write_details_sheet(wb, formats: dict, all_files_data: list):
+    """Details sheet - all line items with full details."""
+    ws = _add_bulk_sheet(wb, formats, "Details", "📋 БҮРЭН ЗАДАРГАА - БҮХ МӨРҮҮД",
+                         [5, 30, 25, 15, 12, 30, 20, 15, 10, 12, 15, 25])
     
-    detail_headers = [
+    ws.write_row(2, 0, [
         "№", "Кампанит ажил", "Суваг", "Дэд суваг", "Төрөл", "Хийгдэх ажил", 
         "Гүйцэтгэгч", "Хариуцагч", "Давтамж", "Нэгж үнэ", "Нийт төсөв", "Тайлбар"
-    ]
-    for col_idx, header in enumerate(detail_headers, 1):
-        cell = ws_details.cell(row=3, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
-    
-    detail_row = 4
-    global_no = 1
+    ], formats['header'])
     
+    # Collect every line item first, then write them in one flat loop
+    detail_rows = []
     for fd in all_files_data:
         header = fd['header']
-        sections = fd['sections']
         campaign_name = header['campaign_name'] or fd['file'].budget_code or fd['file'].filename
         
-        for section in sections:
-            section_name = section['name']
-            
-            # Process subsections
-            if section['subsections']:
-                for sub in section['subsections']:
-                    subsection_name = sub['name']
-                    for r in sub['rows']:
-                        if not isinstance(r, dict):
-                            continue
-                        row_data = [
-                            global_no,
-                            campaign_name,
-                            section_name,
-                            subsection_name,
-                            r.get('type', ''),
-                            r.get('task', ''),
-                            r.get('vendor', ''),
-                            r.get('owner', ''),
-                            r.get('freq', ''),
-                            r.get('unit_price', ''),
-                            r.get('total', 0) if r.get('total') else 0,
-                            r.get('note', '')
-                        ]
-                        
-                        for col_idx, value in enumerate(row_data, 1):
-                            cell = ws_details.cell(row=detail_row, column=col_idx, value=value)
-                            cell.border = thin_border
-                            if col_idx == 11:  # Total column
-                                cell.number_format = currency_format
-                        
-                        detail_row += 1
-                        global_no += 1
-            
-            # Process direct rows (no subsection)
-            elif section['rows']:
-                for r in section['rows']:
-                    if not isinstance(r, dict):
-                        continue
-                    row_data = [
-                        global_no,
-                        campaign_name,
-                        section_name,
-                        "-",
-                        r.get('type', ''),
-                        r.get('task', ''),
-                        r.get('vendor', ''),
-                        r.get('owner', ''),
-                        r.get('freq', ''),
-                        r.get('unit_price', ''),
-                        r.get('total', 0) if r.get('total') else 0,
-                        r.get('note', '')
-                    ]
-                    
-                    for col_idx, value in enumerate(row_data, 1):
-                        cell = ws_details.cell(row=detail_row, column=col_idx, value=value)
-                        cell.border = thin_border
-                        if col_idx == 11:
-                            cell.number_format = currency_format
-                    
-                    detail_row += 1
-                    global_no += 1
-    
-    # Column widths for Details
-    detail_widths = [5, 30, 25, 15, 12, 30, 20, 15, 10, 12, 15, 25]
-    for idx, width in enumerate(detail_widths, 1):
-        ws_details.column_dimensions[chr(64 + idx)].width = width
-    
-    # =========================================================================
-    # SHEET 4: Campaigns - Full campaign metadata
-    # =========================================================================
-    ws_campaigns = wb.create_sheet("Campaigns")
+        for section in fd['sections']:
+            for subsection_name, r in _iter_section_rows(section):
+                detail_rows.append((campaign_name, section['name'], subsection_name, *_line_item_values(r)))
     
-    ws_campaigns.merge_cells('A1:J1')
-    ws_campaigns['A1'] = "📝 КАМПАНИТ АЖЛЫН МЭДЭЭЛЭЛ"
-    ws_campaigns['A1'].font = Font(bold=True, size=14)
-    ws_campaigns['A1'].alignment = Alignment(horizontal="center")
+    row_formats = _bulk_row_formats(formats, 12, currency_columns=(11,))  # Total column
+    for detail_no, row_data in enumerate(detail_rows, 1):
+        _write_bulk_row(ws, detail_no + 2, (detail_no, *row_data), row_formats)
+
+
+def write_campaigns_sheet(wb, formats: dict, all_files_data: list):
+    """Campaigns sheet - full campaign metadata."""
+    ws = _add_bulk_sheet(wb, formats, "Campaigns", "📝 КАМПАНИТ АЖЛЫН МЭДЭЭЛЭЛ",
+                         [5, 35, 25, 20, 15, 35, 25, 35, 20, 25])
     
-    campaign_headers = [
+    ws.write_row(2, 0, [
         "№", "Кампанит ажил", "Төсвийн код", "Маркетингийн код", "Компани",
         "Зорилго", "Зорилтот хэрэглэгчид", "Голлох мессеж", "Хугацаа", "Батлагдсан"
-    ]
-    for col_idx, header in enumerate(campaign_headers, 1):
-        cell = ws_campaigns.cell(row=3, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
-    
-    for row_idx, fd in enumerate(all_files_data, 4):
+    ], formats['header'])
+    
+    row_formats = _bulk_row_formats(formats, 10)
+    for row_idx, fd in enumerate(all_files_data, 3):
         header = fd['header']
         f = fd['file']
         
-        row_data = [
-            row_idx - 3,
+        _write_bulk_row(ws, row_idx, [
+            row_idx - 2,
             header['campaign_name'] or "-",
             header['budget_code'] or f.budget_code or "-",
             header['marketing_code'] or "-",
@@ -370,112 +280,125 @@ def generate_bulk_excel_export(all_files_data: list, all_channel_totals: dict, a
             header['main_message'] or "-",
             header['period'] or "-",
             f"{header['approver']} {header['approver_name']}" if header['approver'] else "-"
-        ]
-        
-        for col_idx, value in enumerate(row_data, 1):
-            cell = ws_campaigns.cell(row=row_idx, column=col_idx, value=value)
-            cell.border = thin_border
+        ], row_formats)
+
+
+def write_channel_details_sheet(wb, formats: dict, all_channel_totals: dict, all_channel_details: dict):
+    """Channel Details sheet - each channel with its breakdown."""
+    ws = _add_bulk_sheet(wb, formats, "Channel Details", "📊 СУВГИЙН ДЭЛГЭРЭНГҮЙ ЗАДАРГАА",
+                         [30, 35, 15, 35, 25, 18, 30])
     
-    campaign_widths = [5, 35, 25, 20, 15, 35, 25, 35, 20, 25]
-    for idx, width in enumerate(campaign_widths, 1):
-        ws_campaigns.column_dimensions[chr(64 + idx)].width = width
+    ws.write_row(2, 0, ["Суваг", "Кампанит ажил", "Дэд суваг", "Ажил", "Гүйцэтгэгч", "Нийт төсөв", "Тайлбар"],
+                 formats['header'])
+    
+    channel_formats = [formats['subheader']] * 7
+    channel_formats[5] = formats['subheader_currency']
+    row_formats = _bulk_row_formats(formats, 7, currency_columns=(6,))
+    ch_row = 3
     
-    # =========================================================================
-    # SHEET 5: Channel Details - Each channel with breakdown
-    # =========================================================================
-    ws_channel_details = wb.create_sheet("Channel Details")
-    
-    ws_channel_details.merge_cells('A1:G1')
-    ws_channel_details['A1'] = "📊 СУВГИЙН ДЭЛГЭРЭНГҮЙ ЗАДАРГАА"
-    ws_channel_details['A1'].font = Font(bold=True, size=14)
-    ws_channel_details['A1'].alignment = Alignment(horizontal="center")
-    
-    ch_detail_headers = ["Суваг", "Кампанит ажил", "Дэд суваг", "Ажил", "Гүйцэтгэгч", "Нийт төсөв", "Тайлбар"]
-    for col_idx, header in enumerate(ch_detail_headers, 1):
-        cell = ws_channel_details.cell(row=3, column=col_idx, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
-    
-    ch_row = 4
     for ch_name in sorted(all_channel_totals.keys()):
-        file_data_list = all_channel_details.get(ch_name, [])
-        
-        # Channel header row
-        cell = ws_channel_details.cell(row=ch_row, column=1, value=ch_name)
-        cell.font = subheader_font
-        cell.fill = subheader_fill
-        for col_idx in range(1, 8):
-            ws_channel_details.cell(row=ch_row, column=col_idx).fill = subheader_fill
-            ws_channel_details.cell(row=ch_row, column=col_idx).border = thin_border
-        
-        total_cell = ws_channel_details.cell(row=ch_row, column=6, value=all_channel_totals[ch_name])
-        total_cell.number_format = currency_format
-        total_cell.font = subheader_font
+        # Channel header row: name in column 1, channel total in column 6
+        _write_bulk_row(ws, ch_row, [ch_name, None, None, None, None, all_channel_totals[ch_name], None],
+                        channel_formats)
         ch_row += 1
         
-        for file_data in file_data_list:
-            section = file_data['section']
+        for file_data in all_channel_details.get(ch_name, []):
             campaign_name = file_data['file_name']
             
-            if section['subsections']:
-                for sub in section['subsections']:
-                    for r in sub['rows']:
-                        row_data = [
-                            "",  # Channel already in header
-                            campaign_name,
-                            sub['name'],
-                            r.get('task', ''),
-                            r.get('vendor', ''),
-                            r.get('total', 0) if r.get('total') else 0,
-                            r.get('note', '')
-                        ]
-                        for col_idx, value in enumerate(row_data, 1):
-                            cell = ws_channel_details.cell(row=ch_row, column=col_idx, value=value)
-                            cell.border = thin_border
-                            if col_idx == 6:
-                                cell.number_format = currency_format
-                        ch_row += 1
-            
-            elif section['rows']:
-                for r in section['rows']:
-                    row_data = [
-                        "",
-                        campaign_name,
-                        "-",
-                        r.get('task', ''),
-                        r.get('vendor', ''),
-                        r.get('total', 0) if r.get('total') else 0,
-                        r.get('note', '')
-                    ]
-                    for col_idx, value in enumerate(row_data, 1):
-                        cell = ws_channel_details.cell(row=ch_row, column=col_idx, value=value)
-                        cell.border = thin_border
-                        if col_idx == 6:
-                            cell.number_format = currency_format
-                    ch_row += 1
-    
-    ch_detail_widths = [30, 35, 15, 35, 25, 18, 30]
-    for idx, width in enumerate(ch_detail_widths, 1):
-        ws_channel_details.column_dimensions[chr(64 + idx)].width = width
-    
-    # Save to BytesIO
-    wb.save(output)
-    output.seek(0)
+            for subsection_name, r in _iter_section_rows(file_data['section']):
+                _, task, vendor, _, _, _, total, note = _line_item_values(r)
+                _write_bulk_row(ws, ch_row, [
+                    "",  # Channel already in header
+                    campaign_name,
+                    subsection_name,
+                    task,
+                    vendor,
+                    total,
+                    note
+                ], row_formats)
+                ch_row += 1
+
+
+def generate_bulk_excel_export(all_files_data: list, all_channel_totals: dict, all_channel_details: dict, grand_totals: dict) -> io.BytesIO:
+    """
+    Generate a comprehensive Excel file with all budget data.
+    
+    Creates an Excel workbook with multiple sheets:
+    1. Summary - All campaigns overview with key metrics
+    2. Channels - Aggregated budget by channel type
+    3. Details - All line items across all files
+    4. Campaigns - Campaign headers and metadata
+    5. Channel Details - Each channel with breakdown
+    
+    Written with XlsxWriter in constant_memory mode: each row is flushed as
+    soon as the next one starts, so sheets must be written top to bottom.
+    
+    Args:
+        all_files_data: List of dicts with file, header, sections, totals
+        all_channel_totals: Dict of channel name -> total budget
+        all_channel_details: Dict of channel name -> list of file data
+        grand_totals: Dict with total_budget and actual_budget
     
-    return output.getvalue()
+    Returns:
+        Excel file as a BytesIO positioned at the start, ready to hand to
+        st.download_button without copying it out to bytes first
+    """
+    import xlsxwriter
+    
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_urls': False})
+    formats = _bulk_export_formats(wb)
+    
+    write_summary_sheet(wb, formats, all_files_data, grand_totals)
+    write_channels_sheet(wb, formats, all_files_data, all_channel_totals, all_channel_details)
+    write_details_sheet(wb, formats, all_files_data)
+    write_campaigns_sheet(wb, formats, all_files_data)
+    write_channel_details_sheet(wb, formats, all_channel_totals, all_channel_details)
+    
+    wb.close()
+    output.seek(0)
+    return output
 
 
 # =============================================================================
 # ANALYTICS TAB
 # =============================================================================
 
-def render_analytics_tab(session):
+@st.cache_data(ttl=60, show_spinner=False)
+def load_analytics_data(status_counts: tuple) -> dict:
+    """
+    Read everything the Analytics tab shows, in one session.
+    
+    `status_counts` (files per status) is only the cache key: it changes
+    whenever a file is uploaded, deleted or moves through the workflow, so
+    widget reruns reuse the result while any new data is picked up.
+    """
+    with get_session() as session:
+        return {
+            'summary': get_budget_summary(session),
+            'by_company': get_budget_by_company(session),
+            'top_campaigns': get_top_campaigns(session, limit=10),
+            'efficiency': get_budget_efficiency(session),
+            'status': get_status_distribution(session),
+        }
+
+
+def get_file_status_counts(session) -> dict:
+    """Files per status (FileStatus -> count), from a single GROUP BY."""
+    return dict(session.exec(
+        select(BudgetFile.status, func.count(BudgetFile.id)).group_by(BudgetFile.status)
+    ).all())
+
+
+def render_analytics_tab(session, status_counts: dict):
     """Render the CPP Analytics tab with charts and KPIs."""
     
+    analytics = load_analytics_data(
+        tuple(sorted((status.value, count) for status, count in status_counts.items()))
+    )
+    
     # Get summary data
-    summary = get_budget_summary(session)
+    summary = analytics['summary']
     
     if summary['file_count'] == 0:
         st.warning("📭 Одоогоор системд өгөгдөл байхгүй байна. Төсөв оруулна уу.")
@@ -486,16 +409,19 @@ def render_analytics_tab(session):
     st.subheader("📊 Гол үзүүлэлтүүд")
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     
+    total_planned = summary['total_planned']
+    total_actual = summary['total_actual']
+    
     with kpi1:
         st.metric(
             "💰 Нийт төсөв", 
-            f"₮{float(summary['total_planned']):,.0f}"
+            f"₮{total_planned:,.0f}"
         )
     
     with kpi2:
         st.metric(
             "💵 Бодит төсөв", 
-            f"₮{float(summary['total_actual']):,.0f}"
+            f"₮{total_actual:,.0f}"
         )
     
     with kpi3:
@@ -506,8 +432,8 @@ def render_analytics_tab(session):
     
     with kpi4:
         # Calculate budget difference (Planned - Actual)
-        if summary['total_planned'] > 0:
-            difference = float(summary['total_planned']) - float(summary['total_actual'])
+        if total_planned > 0:
+            difference = total_planned - total_actual
             delta_color = "normal" if difference >= 0 else "inverse"
             st.metric(
                 "📊 Төсвийн зөрүү",
@@ -526,7 +452,7 @@ def render_analytics_tab(session):
     
     with col1:
         st.subheader("🏢 Компаниар харах")
-        df_company = get_budget_by_company(session)
+        df_company = analytics['by_company']
         
         if not df_company.empty:
             fig_pie = px.pie(
@@ -545,7 +471,7 @@ def render_analytics_tab(session):
     
     with col2:
         st.subheader("🏆 Топ 10 кампанит ажил")
-        df_top = get_top_campaigns(session, limit=10)
+        df_top = analytics['top_campaigns']
         
         if not df_top.empty:
             fig_bar = px.bar(
@@ -573,7 +499,7 @@ def render_analytics_tab(session):
     
     with col3:
         st.subheader("📊 Төсвийн үр ашиг")
-        df_efficiency = get_budget_efficiency(session)
+        df_efficiency = analytics['efficiency']
         
         if not df_efficiency.empty:
             # Create gauge-like bar chart
@@ -600,7 +526,7 @@ def render_analytics_tab(session):
     
     with col4:
         st.subheader("📈 Статусаар харах")
-        df_status = get_status_distribution(session)
+        df_status = analytics['status']
         
         if not df_status.empty:
             status_colors = {
@@ -627,12 +553,11 @@ def render_analytics_tab(session):
     st.divider()
     st.subheader("📋 Дэлгэрэнгүй задаргаа")
     
-    df_company = get_budget_by_company(session)
     if not df_company.empty:
         # Format for display
         df_display = df_company.copy()
-        df_display['PlannedAmount'] = df_display['PlannedAmount'].apply(lambda x: f"₮{x:,.0f}")
-        df_display['ActualAmount'] = df_display['ActualAmount'].apply(lambda x: f"₮{x:,.0f}")
+        df_display['PlannedAmount'] = df_display['PlannedAmount'].map('₮{:,.0f}'.format)
+        df_display['ActualAmount'] = df_display['ActualAmount'].map('₮{:,.0f}'.format)
         df_display.columns = ['Компани', 'Нийт төсөв', 'Бодит', 'Файлын тоо']
         st.dataframe(df_display, width='stretch', hide_index=True)
 
@@ -641,92 +566,101 @@ def render_analytics_tab(session):
 # FILES TAB
 # =============================================================================
 
-def render_files_tab(session):
+def render_files_tab(session, status_counts: dict):
     """Render the Files list tab."""
     
-    # Load all files with uploader data using JOIN
-    statement = (
-        select(BudgetFile, User)
-        .outerjoin(User, BudgetFile.uploader_id == User.id)
-        .order_by(BudgetFile.uploaded_at.desc())
-    )
-    results = session.exec(statement).all()
+    # Status counts come from a GROUP BY - files are only loaded one page at a time
+    total_files = sum(status_counts.values())
     
-    if not results:
+    if not total_files:
         st.info("Одоогоор ямар ч төсөв байхгүй байна.")
         st.page_link("pages/2_📤_Upload.py", label="📤 Төсөв оруулах", icon="📤")
         return
     
-    # Extract files list
-    files = [r[0] for r in results]
-    uploader_map = {r[0].id: r[1] for r in results}
-    
     # Status counts
     st.subheader("📈 Төлөвийн статистик")
     
-    status_counts = {}
-    for file in files:
-        status = file.status.value if hasattr(file.status, 'value') else str(file.status)
-        status_counts[status] = status_counts.get(status, 0) + 1
+    status_order = list(FileStatus)
+    status_counts = dict(sorted(status_counts.items(), key=lambda r: status_order.index(r[0])))
     
     num_cols = min(len(status_counts) + 1, 5)
     cols = st.columns(num_cols)
     
     with cols[0]:
-        st.metric("Нийт файл", len(files))
+        st.metric("Нийт файл", total_files)
     
     for i, (status, count) in enumerate(status_counts.items(), 1):
         if i >= num_cols:
             break
-        status_labels = {
-            "pending_approval": "Хүлээгдэж буй",
-            "approved_for_print": "Батлагдсан",
-            "rejected": "Буцаагдсан",
-            "finalized": "Дууссан"
-        }
         with cols[i]:
-            st.metric(status_labels.get(status, status), count)
+            st.metric(FILE_STATUS_METRIC_LABELS.get(status, status.value), count)
     
     st.divider()
     
     # Files table
     st.subheader("📋 Бүх файлууд")
     
-    data = []
-    for file in files:
-        status = file.status.value if hasattr(file.status, 'value') else str(file.status)
-        status_labels = {
-            "pending_approval": "🕐 Хүлээгдэж буй",
-            "approved_for_print": "✅ Батлагдсан",
-            "rejected": "❌ Буцаагдсан",
-            "finalized": "🏁 Дууссан"
-        }
-        
-        budget_type_label = "Үндсэн" if (hasattr(file.budget_type, 'value') and file.budget_type.value == "primary") else "Нэмэлт"
-        
-        uploader_user = uploader_map.get(file.id)
-        uploader = uploader_user.full_name if uploader_user else "Unknown"
-        
-        actual_str = f"₮{float(file.total_amount):,.0f}" if file.total_amount else "N/A"
-        planned_str = f"₮{float(file.planned_amount):,.0f}" if file.planned_amount else "N/A"
-        upload_date = format_datetime(file.uploaded_at)
-        
-        budget_code = getattr(file, 'budget_code', None) or f"#{file.id}"
-        brand = getattr(file, 'brand', None) or "-"
-        
-        data.append({
-            "Төсвийн код": budget_code,
-            "Брэнд": brand,
-            "Файлын нэр": file.filename,
-            "Төрөл": budget_type_label,
-            "Төлөв": status_labels.get(status, status),
-            "Нийт төсөв": planned_str,
-            "Бодит": actual_str,
-            "Төсөв оруулсан": uploader,
-            "Огноо": upload_date
-        })
+    page_count = (total_files + FILES_PAGE_SIZE - 1) // FILES_PAGE_SIZE
+    page = 1
+    col_sort, col_page = st.columns([2, 1])
+    with col_sort:
+        sort_by = st.selectbox("Эрэмбэлэх", list(FILES_SORT_OPTIONS), key="files_tab_sort")
+    if page_count > 1:
+        with col_page:
+            page = st.number_input(
+                f"Хуудас (нийт {page_count})",
+                min_value=1,
+                max_value=page_count,
+                value=1,
+                step=1,
+                key="files_tab_page"
+            )
     
-    df = pd.DataFrame(data)
+    # Only the displayed columns of the current page, uploader name via JOIN
+    statement = (
+        select(
+            BudgetFile.id,
+            BudgetFile.budget_code,
+            BudgetFile.brand,
+            BudgetFile.filename,
+            BudgetFile.budget_type,
+            BudgetFile.status,
+            BudgetFile.total_amount,
+            BudgetFile.planned_amount,
+            BudgetFile.uploaded_at,
+            User.full_name,
+        )
+        .outerjoin(User, BudgetFile.uploader_id == User.id)
+        .order_by(*FILES_SORT_OPTIONS[sort_by])
+        .offset((page - 1) * FILES_PAGE_SIZE)
+        .limit(FILES_PAGE_SIZE)
+    )
+    files = pd.DataFrame.from_records(session.exec(statement).all(), columns=[
+        'id', 'budget_code', 'brand', 'filename', 'budget_type', 'status',
+        'total_amount', 'planned_amount', 'uploaded_at', 'uploader'
+    ])
+    
+    def text_or(col, default):
+        """Column values, with `default` where missing or empty."""
+        return files[col].where(files[col].fillna('') != '', default)
+    
+    def money_or_na(col):
+        amounts = pd.to_numeric(files[col]).astype(float)
+        return amounts.map('₮{:,.0f}'.format).where(amounts.fillna(0) != 0, "N/A")
+    
+    status_labels = {status: FILE_STATUS_LABELS.get(status, status.value) for status in FileStatus}
+    
+    df = pd.DataFrame({
+        "Төсвийн код": text_or('budget_code', '#' + files['id'].astype(str)),
+        "Брэнд": text_or('brand', "-"),
+        "Файлын нэр": files['filename'],
+        "Төрөл": files['budget_type'].map({BudgetType.PRIMARY: "Үндсэн"}).fillna("Нэмэлт"),
+        "Төлөв": files['status'].map(status_labels),
+        "Нийт төсөв": money_or_na('planned_amount'),
+        "Бодит": money_or_na('total_amount'),
+        "Төсөв оруулсан": text_or('uploader', "Unknown"),
+        "Огноо": pd.to_datetime(files['uploaded_at']).dt.strftime("%Y-%m-%d %H:%M").fillna("N/A")
+    })
     st.dataframe(df, height=400, width='stretch')
 
 
@@ -1137,6 +1071,25 @@ def get_template_sheet(excel_path: str):
         return None, str(e)
 
 
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_budget_breakdown(excel_path: str, mtime: float):
+    """
+    Parsed header, sections and totals of one budget Excel file.
+    
+    The bulk view needs this for every file on each rerun; `mtime` is part
+    of the cache key so a replaced file is parsed again.
+    
+    Returns:
+        Tuple of (header, sections, totals), or None if no TEMPLATE sheet
+    """
+    df, sheet_name = get_template_sheet(excel_path)
+    if df is None:
+        return None
+    
+    sections, totals = parse_excel_sections(df)
+    return parse_budget_header(df), sections, totals
+
+
 def display_budget_header(header: dict):
     """Display budget header information."""
     # Row 1: Approver info
@@ -1314,21 +1267,16 @@ def render_budget_report_tab(session):
     """
     st.subheader("📋 Төсвийн тайлан")
     
-    # Load all files from database
-    statement = (
-        select(BudgetFile, User)
-        .outerjoin(User, BudgetFile.uploader_id == User.id)
-        .order_by(BudgetFile.uploaded_at.desc())
-    )
-    results = session.exec(statement).all()
+    # Load all files from database (uploaders aren't shown here, so no User join)
+    files = session.exec(
+        select(BudgetFile).order_by(BudgetFile.uploaded_at.desc())
+    ).all()
     
-    if not results:
+    if not files:
         st.warning("📭 Одоогоор системд төсөв байхгүй байна.")
         st.page_link("pages/2_📤_Upload.py", label="📤 Төсөв оруулах", icon="📤")
         return
     
-    files = [r[0] for r in results]
-    
     # =========================================================================
     # Two Main Views: Individual vs Bulk
     # =========================================================================
@@ -1410,12 +1358,11 @@ def render_budget_report_tab(session):
             if not excel_path or not os.path.exists(excel_path):
                 continue
             
-            df, sheet_name = get_template_sheet(excel_path)
-            if df is None:
+            breakdown = load_budget_breakdown(excel_path, os.path.getmtime(excel_path))
+            if breakdown is None:
                 continue
             
-            header = parse_budget_header(df)
-            sections, totals = parse_excel_sections(df)
+            header, sections, totals = breakdown
             
             all_files_data.append({
                 'file': f,
@@ -1586,16 +1533,15 @@ def render_budget_report_tab(session):
             # BULK XLSX Export - All data in one Excel file with multiple sheets
             with col3:
                 try:
-                    xlsx_data = generate_bulk_excel_export(all_files_data, all_channel_totals, all_channel_details, grand_totals)
-                    if xlsx_data:
-                        date_str = datetime.now().strftime("%Y%m%d_%H%M")
-                        st.download_button(
-                            label="📥 Нэгтгэсэн XLSX татах",
-                            data=xlsx_data,
-                            file_name=f"Budget_Bulk_Export_{date_str}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            type="primary"
-                        )
+                    xlsx_file = generate_bulk_excel_export(all_files_data, all_channel_totals, all_channel_details, grand_totals)
+                    date_str = datetime.now().strftime("%Y%m%d_%H%M")
+                    st.download_button(
+                        label="📥 Нэгтгэсэн XLSX татах",
+                        data=xlsx_file,
+                        file_name=f"Budget_Bulk_Export_{date_str}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        type="primary"
+                    )
                 except Exception as e:
                     st.error(f"XLSX үүсгэхэд алдаа: {e}")
 
@@ -1698,8 +1644,14 @@ def render_export_tab(session):
 # CPP REPORT TAB - EDITABLE GRID WITH DATABASE SAVE
 # =============================================================================
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_cpp_items_for_sheet(sheet_name: str):
-    """Get CPP items from database for a specific sheet."""
+    """
+    Get CPP items from database for a specific sheet.
+    
+    Cached briefly so widget reruns don't re-query; save_cpp_items_for_sheet
+    clears the cache.
+    """
     from database import get_session, CppBudgetItem
     from sqlmodel import select
     
@@ -1725,41 +1677,63 @@ def get_cpp_items_for_sheet(sheet_name: str):
         return data
 
 
+def filled_rows_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Rows of an edited grid with at least one filled-in cell.
+    
+    Empty means missing, blank text, or 0 in a numeric column. Computed per
+    column, so cells are only converted to text where the column isn't
+    numeric already.
+    """
+    filled = pd.Series(False, index=df.index)
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            filled |= values.notna() & values.ne(0)
+        else:
+            filled |= values.notna() & values.astype(str).str.strip().ne('')
+    return filled
+
+
 def save_cpp_items_for_sheet(sheet_name: str, owner_id: int, owner_username: str, rows: list):
     """Save CPP items to database for a specific sheet."""
     from database import get_session, CppBudgetItem
-    from sqlmodel import select
+    from sqlalchemy import delete
     import json
     from datetime import datetime
     
     with get_session() as session:
-        # Delete existing rows for this user & sheet
-        existing = session.exec(
-            select(CppBudgetItem)
+        # Delete existing rows for this user & sheet (one DELETE, rows are
+        # not loaded first)
+        session.execute(
+            delete(CppBudgetItem)
             .where(CppBudgetItem.category_name == sheet_name)
             .where(CppBudgetItem.owner_id == owner_id)
-        ).all()
-        
-        for item in existing:
-            session.delete(item)
+        )
         
-        # Add new rows
+        # Add new rows as one executemany INSERT (no ORM objects)
+        updated_at = datetime.utcnow()
+        new_rows = []
         for idx, row_data in enumerate(rows, 1):
             # Filter out internal columns
             clean_data = {k: v for k, v in row_data.items() if not k.startswith('_') and pd.notna(v)}
             
-            new_item = CppBudgetItem(
-                owner_id=owner_id,
-                owner_username=owner_username,
-                category_name=sheet_name,
-                row_number=idx,
-                custom_fields=json.dumps(clean_data, ensure_ascii=False, default=str),
-                status="draft",
-                updated_at=datetime.utcnow()
-            )
-            session.add(new_item)
+            new_rows.append({
+                "owner_id": owner_id,
+                "owner_username": owner_username,
+                "category_name": sheet_name,
+                "row_number": idx,
+                "custom_fields": json.dumps(clean_data, ensure_ascii=False, default=str),
+                "status": "draft",
+                "updated_at": updated_at,
+            })
+        
+        if new_rows:
+            session.execute(CppBudgetItem.__table__.insert(), new_rows)
         
         session.commit()
+    
+    get_cpp_items_for_sheet.clear()  # Grids must show the saved rows
 
 
 def get_tv_data_from_budget_files(user_id: int = None):
@@ -1898,10 +1872,15 @@ def get_tv_data_from_budget_files(user_id: int = None):
     return tv_rows
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_campaign_options():
-    """Get list of campaign names from budget files for dropdown."""
+    """
+    Get list of campaign names from budget files for dropdown.
+    
+    Cached briefly: the campaign dropdowns rerender on every edit.
+    """
     from database import get_session, BudgetFile, BudgetItem
-    from sqlmodel import select
+    from sqlmodel import select, func
     
     # Map budget code first letter to company name
     company_map = {
@@ -1916,33 +1895,43 @@ def get_campaign_options():
         # Get all budget files with campaign names
         files = session.exec(select(BudgetFile)).all()
         
-        campaigns = []
-        seen_names = set()
+        # First file per campaign name
+        campaign_files = {}
         for f in files:
-            if f.campaign_name and f.campaign_name not in seen_names:
-                seen_names.add(f.campaign_name)
-                
-                # Get company from budget_code first letter
-                company = ''
-                if f.budget_code and len(f.budget_code) > 0:
-                    company_code = f.budget_code[0].upper()
-                    company = company_map.get(company_code, '')
-                
-                # Fallback: try to get from BudgetItem vendor field
-                if not company:
-                    first_item = session.exec(
-                        select(BudgetItem).where(BudgetItem.file_id == f.id)
-                    ).first()
-                    if first_item and first_item.vendor:
-                        company = first_item.vendor
-                
-                campaigns.append({
-                    'name': f.campaign_name,
-                    'budget_code': f.budget_code or '',
-                    'company': company,
-                    'brand': f.brand or '',
-                    'specialist': f.specialist_name or '',
-                })
+            if f.campaign_name and f.campaign_name not in campaign_files:
+                campaign_files[f.campaign_name] = f
+        
+        # Company from budget_code first letter
+        companies = {}
+        for f in campaign_files.values():
+            if f.budget_code and len(f.budget_code) > 0:
+                company_code = f.budget_code[0].upper()
+                companies[f.id] = company_map.get(company_code, '')
+        
+        # Fallback: vendor of each remaining file's first BudgetItem, all in one query
+        fallback_ids = [f.id for f in campaign_files.values() if not companies.get(f.id)]
+        if fallback_ids:
+            first_item_ids = (
+                select(func.min(BudgetItem.id))
+                .where(BudgetItem.file_id.in_(fallback_ids))
+                .group_by(BudgetItem.file_id)
+            )
+            first_items = session.exec(
+                select(BudgetItem.file_id, BudgetItem.vendor).where(BudgetItem.id.in_(first_item_ids))
+            ).all()
+            for file_id, vendor in first_items:
+                if vendor:
+                    companies[file_id] = vendor
+        
+        campaigns = []
+        for f in campaign_files.values():
+            campaigns.append({
+                'name': f.campaign_name,
+                'budget_code': f.budget_code or '',
+                'company': companies.get(f.id, ''),
+                'brand': f.brand or '',
+                'specialist': f.specialist_name or '',
+            })
         return campaigns
 
 
@@ -2254,6 +2243,22 @@ def render_tv_sheet(current_user):
     
     with col1:
         if st.button("💾 Хадгалах", key="save_tv", type="primary", width='stretch'):
+            # Formula columns for all rows at once; unparseable input gives NaN
+            start_dates = pd.to_datetime(edited_df['Эхлэх өдөр'], errors='coerce')
+            end_dates = pd.to_datetime(edited_df['Дуусах өдөр'], errors='coerce')
+            total_days = (end_dates - start_dates).dt.days
+            # Нийт сурталчилгааны урт = Сурталчилгааны урт × Нийт давтамж
+            total_ad_seconds = (
+                pd.to_numeric(edited_df['Сурталчилгааны урт'], errors='coerce')
+                * pd.to_numeric(edited_df['Нийт давтамж'], errors='coerce')
+            )
+            # Үнийн дүн = Нийт сурталчилгааны урт × 1 секундын үнэлгээ (blank price = 0)
+            price_per_second = pd.to_numeric(
+                edited_df['1 секундын үнэлгээ (₮)'].astype(str).str.replace(',', '', regex=False).str.strip(),
+                errors='coerce'
+            ).fillna(0)
+            total_prices = total_ad_seconds * price_per_second
+            
             rows_to_save = []
             for idx, row in edited_df.iterrows():
                 row_dict = row.to_dict()
@@ -2279,31 +2284,11 @@ def render_tv_sheet(current_user):
                 # Row number
                 row_dict['№'] = idx + 1
                 
-                # Calculate Нийт өдөр
-                try:
-                    start_date = pd.to_datetime(row_dict.get('Эхлэх өдөр'))
-                    end_date = pd.to_datetime(row_dict.get('Дуусах өдөр'))
-                    if pd.notna(start_date) and pd.notna(end_date):
-                        row_dict['Нийт өдөр'] = (end_date - start_date).days
-                except:
-                    pass
-                
-                # Calculate Нийт сурталчилгааны урт
-                try:
-                    ad_length = float(row_dict.get('Сурталчилгааны урт') or 0)
-                    frequency = float(row_dict.get('Нийт давтамж') or 0)
-                    row_dict['Нийт сурталчилгааны урт'] = ad_length * frequency
-                except:
-                    pass
-                
-                # Calculate Үнийн дүн
-                try:
-                    total_seconds = float(row_dict.get('Нийт сурталчилгааны урт') or 0)
-                    price_str = str(row_dict.get('1 секундын үнэлгээ (₮)') or '0').replace(',', '').strip()
-                    price_per_sec = float(price_str) if price_str else 0
-                    row_dict['Үнийн дүн (₮)'] = total_seconds * price_per_sec
-                except:
-                    pass
+                # Formula columns (computed for all rows above)
+                if pd.notna(total_days[idx]):
+                    row_dict['Нийт өдөр'] = int(total_days[idx])
+                row_dict['Нийт сурталчилгааны урт'] = total_ad_seconds[idx]
+                row_dict['Үнийн дүн (₮)'] = total_prices[idx]
                 
                 # Only save non-empty rows
                 if any(v for k, v in row_dict.items() if k not in ['№', '_owner', '_owner_id'] and pd.notna(v) and str(v).strip()):
@@ -2419,10 +2404,8 @@ def render_editable_sheet(sheet_name: str, current_user, columns_def: list):
     
     with col1:
         if st.button("💾 Хадгалах", key=f"save_{sheet_name}", type="primary", width='stretch'):
-            # Convert to list of dicts
-            rows_to_save = edited_df.to_dict('records')
-            # Filter out completely empty rows
-            rows_to_save = [r for r in rows_to_save if any(v for k, v in r.items() if pd.notna(v) and str(v).strip())]
+            # Convert non-empty rows to list of dicts
+            rows_to_save = edited_df[filled_rows_mask(edited_df)].to_dict('records')
             
             save_cpp_items_for_sheet(sheet_name, current_user_id, current_username, rows_to_save)
             st.success(f"✅ {len(rows_to_save)} мөр хадгалагдлаа!")
@@ -2640,11 +2623,14 @@ def main():
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["📈 CPP Analytics", "📋 Файлууд", "📑 Төсвийн тайлан", "📥 CPP Report", "📄 PDF Export"])
     
     with get_session() as session:
+        # Shared by the Analytics (cache key) and Files (metrics) tabs
+        status_counts = get_file_status_counts(session)
+        
         with tab1:
-            render_analytics_tab(session)
+            render_analytics_tab(session, status_counts)
         
         with tab2:
-            render_files_tab(session)
+            render_files_tab(session, status_counts)
         
         with tab3:
             render_budget_report_tab(session)
@@ -2660,7 +2646,4 @@ def main():
 # RUN PAGE
 # =============================================================================
 
-if __name__ == "__main__":
-    main()
-else:
-    main()
+main()